@@ -1,30 +1,357 @@
-import random
+import array
+import os
+import pickle
 import sys
+import time
+import zlib
 
-from maze import Cell, Maze
+from maze import (DIRECTIONS, DOWN, DX, DY, LEFT, OPPOSITES, OTHERS, PERMUTATIONS, PERPENDICULARS, RIGHT, UP, Bitset,
+                  Cell, Maze)
+from randomness import RandomSource
 
 try:
-    from typing import Any, Callable, Dict, List, Set, Tuple, Union
+    from typing import Any, Callable, Dict, Iterator, List, Set, Tuple, Union
 except ImportError:
-    Any, Callable, Dict, List, Set, Tuple, Union = None, None, None, None, None, None, None
+    Any, Callable, Dict, Iterator, List, Set, Tuple, Union = None, None, None, None, None, None, None, None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Translation tables of the masks which add the link in a direction, e.g. for linking rows with 'bytes.translate'.
+LINK_TABLES = tuple(bytes(mask | 1 << direction for mask in range(256))
+                    for direction in DIRECTIONS)  # type: Tuple[bytes, ...]
 
 
 # FIXME: Write a RandomSet class (pop fully random)?
 
+class Generation(object):
+    """
+    A generation in progress. Generations advance by steps of a given amount of work (usually one unit per cell), so
+    that they can be scheduled cooperatively: interleaved with other generations, driven from an event loop or a GUI,
+    or cancelled before the end.
+
+    Each algorithm provides a subclass which overrides :meth:`_run`. This class alone is a generation with nothing left
+    to do.
+    """
+
+    DEFAULT_BUDGET = 4096  # Units of work of a step.
+    CHECKPOINT_BUDGET = 1 << 16  # Units of work between two checks of the time for saving checkpoints.
+
+    def __init__(self, maze):
+        # type: (Maze) -> None
+
+        self._maze = maze  # type: Maze
+        self._is_done = False  # type: bool
+
+    def cancel(self):
+        # type: () -> None
+
+        self._is_done = True
+
+    def finish(self, checkpoint=None, interval=60.0):
+        # type: (Union[str, None], float) -> Maze
+
+        """
+        Do all the work left. If a checkpoint path is given, the generation is saved there every 'interval' seconds
+        (see :meth:`save`), so that it can be resumed with :meth:`load` if it is interrupted. The checkpoint is removed
+        once the generation is done.
+        """
+
+        if checkpoint is None:
+            while not self._is_done:
+                self._advance(sys.maxsize)
+            return self._maze
+
+        last_save = time.monotonic()
+        while not self._is_done:
+            self._advance(Generation.CHECKPOINT_BUDGET)
+            if time.monotonic() - last_save >= interval and not self._is_done:
+                self.save(checkpoint)
+                last_save = time.monotonic()
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        return self._maze
+
+    def is_done(self):
+        # type: () -> bool
+
+        return self._is_done
+
+    @staticmethod
+    def load(path):
+        # type: (str) -> Generation
+
+        """
+        Load a generation saved by :meth:`save`. It continues exactly where it stopped: with the same random source, it
+        ends with the same maze as if it had not been interrupted. Checkpoints are pickles: only load trusted ones.
+        """
+
+        with open(path, 'rb') as file:
+            return pickle.loads(zlib.decompress(file.read()))
+
+    def maze(self):
+        # type: () -> Maze
+
+        return self._maze
+
+    def save(self, path):
+        # type: (str) -> None
+
+        """
+        Save the whole state of the generation (the maze, the visited cells, the stacks or frontiers, the random source,
+        ...) as a compressed checkpoint. The file is replaced at once, so that an interruption while saving keeps the
+        previous checkpoint.
+        """
+
+        data = zlib.compress(pickle.dumps(self, pickle.HIGHEST_PROTOCOL))
+        with open(path + '.tmp', 'wb') as file:
+            file.write(data)
+        os.replace(path + '.tmp', path)
+
+    def step(self, budget=DEFAULT_BUDGET):
+        # type: (int) -> array.array
+
+        """
+        Do at most 'budget' units of work, and return the carve events of that work: the entries appended to the journal
+        of the maze (see :class:`maze.Journal`). If the maze has no journal, one is only kept for the step.
+        """
+
+        is_temporary = self._maze.journal() is None
+        journal = self._maze.enable_journal()
+        mark = journal.mark()
+        self._advance(budget)
+        events = journal.entries(mark)
+        if is_temporary:
+            self._maze.disable_journal()
+
+        return events
+
+    @staticmethod
+    def round_robin(generations, budget=DEFAULT_BUDGET):
+        # type: (List[Generation], int) -> Iterator[Tuple[Generation, array.array]]
+
+        """
+        Step the generations in turn until they are all done, yielding each generation with the events of its step.
+        """
+
+        pending = [generation for generation in generations if not generation.is_done()]
+        while pending:
+            for generation in pending:
+                yield generation, generation.step(budget)
+            pending = [generation for generation in pending if not generation.is_done()]
+
+    def _advance(self, budget):
+        # type: (int) -> None
+
+        if not self._is_done:
+            self._is_done = not self._run(budget)
+
+    def _run(self, budget):
+        # type: (int) -> bool
+
+        """
+        Do at most 'budget' units of work. Return whether there is work left.
+        """
+
+        return False
+
+
 class Algorithm(object):
     """
-    Abstract class. All algorithm must override the methods of this class.
+    Abstract class. All algorithm must override :meth:`start`, which prepares a :class:`Generation` without doing any
+    work yet. :meth:`run` does all the work at once.
     """
 
+    # Whether the parameters can give a maze to carve, e.g. a maze with sub mazes to fill (see :class:`layout.Layout`).
+    TAKES_MAZE = False
+
     # TODO: Make a class out of 'parameters'. Note: parameter = (maze, (start_x, start_y))
+    # All the random draws of an algorithm come from 'rng', so that runs with seeded random sources are reproducible.
+    @classmethod
+    def run(cls, width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Maze
+
+        return cls.start(width, height, parameters, rng).finish()
+
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
 
         raise NotImplementedError('Class {} is abstract'.format(Algorithm.__name__))
 
 
-class Braid(object):
+class RowGeneration(Generation):
+    """
+    Generation of the algorithms which decide the links of whole rows at once, with NumPy: the masks of a block of rows
+    are computed as arrays and written to the maze in one copy. One unit of work is one cell.
+
+    Subclasses override :meth:`_carve`. The whole maze is written, so there are no sub-mazes.
+    """
+
+    BLOCK_SIZE = 1 << 20  # Maximum number of cells of a block of rows.
+
+    def __init__(self, maze, rng):
+        # type: (Maze, RandomSource) -> None
+
+        if numpy is None:
+            raise RuntimeError('NumPy is required for generating whole rows')
+
+        Generation.__init__(self, maze)
+        self._rng = rng  # type: RandomSource
+        self._y = 0  # type: int
+        # Masks of the last row written: its links down are only known with the next block.
+        self._last_row = None  # type: Any
+
+    def _carve(self, y, num_rows):
+        # type: (int, int) -> Tuple[Any, Any]
+
+        """
+        Decide the links of a block of rows starting at row 'y'. Return two boolean arrays of shape (num_rows, width):
+        whether each cell is linked up, and whether it is linked right.
+        """
+
+        raise NotImplementedError('Class {} is abstract'.format(RowGeneration.__name__))
+
+    def _run(self, budget):
+        # type: (int) -> bool
+
+        maze = self._maze
+        width = maze.width()
+        y = self._y
+        num_rows = min(max(1, min(budget, RowGeneration.BLOCK_SIZE) // width), maze.height() - y)
+        up, right = self._carve(y, num_rows)
+        up = up.view(numpy.uint8)
+        right = right.view(numpy.uint8)
+
+        masks = (up << UP) | (right << RIGHT)
+        masks[:, 1:] |= right[:, :-1] << LEFT
+        masks[:-1] |= up[1:] << DOWN
+        if self._last_row is not None:
+            self._last_row |= up[0] << DOWN
+            maze.write_masks((y - 1) * width, self._last_row)
+        maze.write_masks(y * width, masks)
+        self._last_row = masks[-1].copy()
+        self._y = y + num_rows
+
+        return self._y < maze.height()
+
+
+class MaskGeneration(Generation):
+    """
+    Generation of the algorithms which compute their mazes in closed form: the masks of all the cells are computed by
+    :meth:`_compute_masks` on the first step, then written to the maze by blocks of rows. One unit of work is one cell.
+    """
+
+    def __init__(self, maze):
+        # type: (Maze) -> None
+
+        Generation.__init__(self, maze)
+        self._masks = None  # type: Union[bytearray, None]
+        self._position = 0  # type: int
+
+    def _compute_masks(self):
+        # type: () -> bytearray
+
+        raise NotImplementedError('Class {} is abstract'.format(MaskGeneration.__name__))
+
+    def _run(self, budget):
+        # type: (int) -> bool
+
+        if self._masks is None:
+            self._masks = self._compute_masks()
+
+        width = self._maze.width()
+        count = min(max(1, budget // width) * width, len(self._masks) - self._position)
+        self._maze.write_masks(self._position, memoryview(self._masks)[self._position:self._position + count])
+        self._position += count
+
+        return self._position < len(self._masks)
+
+
+class LatticeGeneration(MaskGeneration):
+    """
+    Generation of the algorithms which run on a lattice of half the resolution of the maze: a generation runs on a maze
+    of about half the width and the height, then the masks of that maze are expanded to the full resolution at once, by
+    :meth:`_expand`, and written by blocks of rows. One unit of work is one unit of the generation on the lattice, then
+    one cell.
+    """
+
+    def __init__(self, maze, lattice_generation):
+        # type: (Maze, Generation) -> None
+
+        if numpy is None:
+            raise RuntimeError('NumPy is required for expanding lattices')
+
+        MaskGeneration.__init__(self, maze)
+        self._lattice = lattice_generation  # type: Generation
+
+    def _compute_masks(self):
+        # type: () -> bytearray
+
+        lattice = self._lattice.maze()
+        masks = numpy.frombuffer(lattice.export_to_masks(), dtype=numpy.uint8).reshape(lattice.height(), lattice.width())
+        return bytearray(self._expand(masks).tobytes())
+
+    def _expand(self, masks):
+        # type: (Any) -> Any
+
+        """
+        Return the masks of the maze, as a NumPy array of height x width, from the masks of the lattice.
+        """
+
+        raise NotImplementedError('Class {} is abstract'.format(LatticeGeneration.__name__))
+
+    def _run(self, budget):
+        # type: (int) -> bool
+
+        if not self._lattice.is_done():
+            self._lattice._advance(budget)
+            return True
+
+        return MaskGeneration._run(self, budget)
+
+
+class BinaryTree(Algorithm):
+    """
+    Each cell is linked either up or left, at random. The cells of the first row are all linked left, and the cells of
+    the first column are all linked up. Very fast, but the maze is strongly biased: long corridors run along the top and
+    left sides.
+
+    Needs NumPy.
+    """
+
+    class _Generation(RowGeneration):
+        def _carve(self, y, num_rows):
+            # type: (int, int) -> Tuple[Any, Any]
+
+            width = self._maze.width()
+            up = (self._rng.words(num_rows * width).reshape(num_rows, width) & 1).astype(bool)
+            up[:, 0] = True
+            if y == 0:
+                up[0] = False
+            right = numpy.zeros_like(up)
+            right[:, :-1] = ~up[:, 1:]  # Cells linked left.
+
+            return up, right
+
+    @staticmethod
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
+
+        if rng is None:
+            rng = RandomSource()
+
+        if parameters and parameters[0] is not None:
+            raise ValueError('BinaryTree generates its own maze')
+
+        return BinaryTree._Generation(Maze(width, height, True, False), rng)
+
+
+class Braid(Algorithm):
     """
     A maze with no dead ends. An algorithm is provided to generate an first maze whose dead ends will be removed. If no
     algorithm is provided, it defaults to RecursiveBackTracker.
@@ -33,9 +360,66 @@ class Braid(object):
     can be provided.
     """
 
+    class _Generation(Generation):
+        """
+        Run the generation of the first maze, then remove the dead ends. One unit of work is one cell.
+        """
+
+        def __init__(self, base, percentage, rng):
+            # type: (Generation, float, RandomSource) -> None
+
+            Generation.__init__(self, base.maze())
+            self._base = base  # type: Generation
+            self._percentage = percentage  # type: float
+            self._rng = rng  # type: RandomSource
+            self._visited = self._maze.new_visited()  # type: Bitset
+            # Sets of cells are dicts: their order does not depend on hashes, so runs are reproducible.
+            self._frontier = {0: None}  # type: Dict[int, None]
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            if not self._base.is_done():
+                self._base._advance(budget)
+                if not self._base.is_done():
+                    return True
+
+            maze = self._maze
+            rng = self._rng
+            visited = self._visited
+            frontier = self._frontier
+            while frontier and budget > 0:
+                budget -= 1
+                current_cell = frontier.popitem()[0]
+                visited.add(current_cell)
+
+                connected_directions = [direction for direction in DIRECTIONS if maze.is_link_open(current_cell, direction)]
+
+                # If the current cell is a dead end or is completely closed, make a new passage.
+                if len(connected_directions) <= 1 and rng.random() <= self._percentage:
+                    directions = rng.permutation()
+                    if len(connected_directions) == 1:  # Prefer the facing direction.
+                        opened_direction = connected_directions[0]
+                        directions = (OPPOSITES[opened_direction],) + tuple(
+                            direction for direction in directions if direction in PERPENDICULARS[opened_direction])
+                    for carve_direction in directions:
+                        if maze.neighbor_index(current_cell, carve_direction) >= 0:
+                            maze.set_link(current_cell, carve_direction, True)
+                            break
+
+                for direction in DIRECTIONS:
+                    neighbor = maze.neighbor_index(current_cell, direction)
+                    if neighbor >= 0 and neighbor not in visited:
+                        frontier[neighbor] = None
+
+            return bool(frontier)
+
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
+
+        if rng is None:
+            rng = RandomSource()
 
         # TODO: Parameters here are special: (maze, (start_x, start_y), maze_algorithm, percentage)
         # TODO: Do not erase sub mazes? Start?
@@ -46,112 +430,403 @@ class Braid(object):
             maze_algorithm = RecursiveBackTracker
             percentage = 1
 
-        maze = maze_algorithm.run(width, height)
-
-        # Reset all the cells as unvisited.
-        for y in range(height):
-            for x in range(width):
-                maze.cell(x, y).set_meta(False)
-
-        frontier = {maze.cell(0, 0)}
-        while frontier:
-            current_cell = frontier.pop()
-            current_cell.set_meta(True)
-
-            connected_directions = set()
-            for direction in Maze.Direction:
-                if current_cell.has_neighbor(direction) and current_cell.is_open(direction):
-                    connected_directions.add(direction)
-
-            # If the current cell is a dead end or is completely closed, make a new passage.
-            if len(connected_directions) <= 1 and random.random() <= percentage:
-                other_directions = set(Maze.Direction)
-                if len(connected_directions) == 1:  # Prefer the facing direction.
-                    opened_direction = connected_directions.pop()
-                    carve_direction = opened_direction.opposite()
-                    other_directions.remove(opened_direction)
-                    other_directions.remove(carve_direction)
+        return Braid._Generation(maze_algorithm.start(width, height, rng=rng), percentage, rng)
+
+
+class Frontier(Algorithm):
+    """
+    Randomly flood the space.
+
+    The cells of the tank are only connected to cells visited by this run, so that no patch of cells is added to the
+    sub-mazes of the maze.
+
+    The parameters are (maze, (start_x, start_y), layered). With 'layered', each layer of the frontier is processed at
+    once with NumPy (see :class:`Frontier._LayerGeneration`), which is much faster on large mazes for the same kind of
+    texture.
+    """
+
+    TAKES_MAZE = True
+
+    class _Generation(Generation):
+        """
+        One unit of work is one cell of the frontier, one cell of the tank, or the swap to the next layer.
+        """
+
+        def __init__(self, maze, initial_cell, rng):
+            # type: (Maze, int, RandomSource) -> None
+
+            Generation.__init__(self, maze)
+            self._rng = rng  # type: RandomSource
+            self._visited = maze.new_visited()  # type: Bitset
+            self._visited.add(initial_cell)
+            self._frontier = [initial_cell]  # type: List[int]
+            self._new_frontier = list()  # type: List[int]
+            self._tank = dict()  # type: Dict[int, None]
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            maze = self._maze
+            rng = self._rng
+            sub_maze_cells = maze.sub_maze_cells()
+            visited = self._visited
+            frontier = self._frontier
+            new_frontier = self._new_frontier
+            tank = self._tank
+
+            while budget > 0:
+                budget -= 1
+                if frontier:
+                    # Randomly choose a cell from the frontier, and replace it with the last one.
+                    position = rng.randrange(len(frontier))
+                    cell = frontier[position]
+                    frontier[position] = frontier[-1]
+                    frontier.pop()
+
+                    # Randomly choose directions to explore: the first ones of a random ordering. The others go to the
+                    # tank.
+                    num_directions = rng.randint(0, 4)
+                    for index, direction in enumerate(rng.permutation()):
+                        neighbor = maze.neighbor_index(cell, direction)
+                        if neighbor >= 0 and neighbor not in visited:
+                            if index < num_directions:
+                                maze.set_link(cell, direction, True)
+                                visited.add(neighbor)
+                                new_frontier.append(neighbor)
+                            else:
+                                tank[neighbor] = None
+                elif new_frontier:
+                    frontier, new_frontier = new_frontier, list()
+                elif tank:
+                    # As some directions are ignored, some cells could have been visited but are not. And because some
+                    # directions are ignored, not all the space is visited. The tank is the list of cells that could
+                    # have been visited but have been ignored. Some of them have actually been visited by another path,
+                    # so those are removed.
+                    cell = tank.popitem()[0]
+                    if cell not in visited:
+                        # Connect to a random direction that have already been visited by this run.
+                        for direction in rng.permutation():
+                            neighbor = maze.neighbor_index(cell, direction)
+                            if neighbor >= 0 and neighbor in visited and neighbor not in sub_maze_cells:
+                                maze.set_link(cell, direction, True)
+                                visited.add(cell)
+                                frontier.append(cell)
+                                break
                 else:
-                    carve_direction = random.choice(other_directions)
-                    other_directions.remove(carve_direction)
-                while not current_cell.has_neighbor(carve_direction):
-                    carve_direction = random.choice(list(other_directions))
-                    other_directions.remove(carve_direction)
+                    break
 
-                current_cell.open(carve_direction)
+            self._frontier = frontier
+            self._new_frontier = new_frontier
 
-            for direction in Maze.Direction:
-                if current_cell.has_neighbor(direction) and not current_cell.get_neighbor(direction).get_meta():
-                    frontier.add(current_cell.get_neighbor(direction))
+            return bool(frontier or new_frontier or tank)
 
-        return maze
+    class _LayerGeneration(Generation):
+        """
+        The cells of a layer of the frontier are processed together, as arrays: the directions they explore are drawn
+        in bulk, and when several cells reach the same cell, the link with the highest random priority is kept. The
+        cells left out go to the tank, which is emptied at once when the flood stops: each of its unvisited cells is
+        linked to a random visited neighbor, and they make the next layer. One unit of work is one cell of a layer or
+        of the tank, and layers are not split between steps. The links are written to the maze at the end of each step,
+        all at once.
+        """
 
+        # Directions explored by a cell, by ordering of the directions and number of directions, as bits.
+        EXPLORED = numpy.array([[sum(1 << direction for direction in permutation[:count]) for count in range(5)]
+                                for permutation in PERMUTATIONS], dtype=numpy.uint8) if numpy is not None else None
+        # Position of the n-th set bit of the masks of 4 bits, by mask and n.
+        NTH_BIT = numpy.array([[([code for code in DIRECTIONS if mask >> code & 1] + [0] * 4)[n] for n in range(4)]
+                               for mask in range(16)], dtype=numpy.int64) if numpy is not None else None
+        POPCOUNT = numpy.array([bin(mask).count('1') for mask in range(16)], dtype=numpy.uint64) \
+            if numpy is not None else None
+
+        def __init__(self, maze, initial_cell, rng):
+            # type: (Maze, int, RandomSource) -> None
+
+            if numpy is None:
+                raise RuntimeError('NumPy is required for processing the frontier by layers')
+
+            Generation.__init__(self, maze)
+            num_cells = maze.width() * maze.height()
+            self._rng = rng  # type: RandomSource
+            self._sub_maze_cells = numpy.unpackbits(numpy.frombuffer(maze.sub_maze_cells().to_bytes(), numpy.uint8),
+                                                    count=num_cells, bitorder='little').view(numpy.bool_)  # type: Any
+            self._visited = numpy.unpackbits(numpy.frombuffer(maze.new_visited().to_bytes(), numpy.uint8),
+                                             count=num_cells, bitorder='little').view(numpy.bool_)  # type: Any
+            self._visited[initial_cell] = True
+            self._layer = numpy.array([initial_cell], dtype=numpy.int64)  # type: Any
+            self._tank = list()  # type: List[Any]
+            # Links not written to the maze yet: arrays of cells and of directions.
+            self._links = list()  # type: List[Tuple[Any, Any]]
+
+        def _neighbors(self, cells, direction):
+            # type: (Any, int) -> Tuple[Any, Any]
 
-class Frontier(Algorithm):
+            """
+            Return the neighbors of cells in a direction, and whether they exist.
+            """
+
+            width = self._maze.width()
+            if direction == LEFT:
+                exists = cells % width > 0
+            elif direction == UP:
+                exists = cells >= width
+            elif direction == RIGHT:
+                exists = cells % width < width - 1
+            else:
+                exists = cells < len(self._visited) - width
+            neighbors = cells + (DX[direction] + DY[direction] * width)
+            return numpy.where(exists, neighbors, 0), exists
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            while budget > 0:
+                if len(self._layer):
+                    budget -= len(self._layer)
+                    self._layer = self._flood(self._layer)
+                elif self._tank:
+                    tank = numpy.concatenate(self._tank)
+                    self._tank = list()
+                    budget -= len(tank)
+                    self._layer = self._connect(numpy.unique(tank[~self._visited[tank]]))
+                else:
+                    break
+
+            if self._links:
+                cells, directions = zip(*self._links)
+                self._links = list()
+                self._maze.open_links(numpy.concatenate(cells), numpy.concatenate(directions))
+
+            return bool(len(self._layer) or self._tank)
+
+        def _connect(self, cells):
+            # type: (Any) -> Any
+
+            """
+            Link cells of the tank to random neighbors visited by this run, and return them.
+            """
+
+            visited = self._visited
+            eligible = numpy.zeros(len(cells), dtype=numpy.uint8)
+            for direction in DIRECTIONS:
+                neighbors, exists = self._neighbors(cells, direction)
+                eligible |= ((exists & visited[neighbors] & ~self._sub_maze_cells[neighbors]).astype(numpy.uint8) <<
+                             direction)
+            # Every cell of the tank has a neighbor in the frontier which put it there, so none is left out here.
+            cells = cells[eligible > 0]
+            eligible = eligible[eligible > 0]
+            draws = (self._rng.words(len(cells)).astype(numpy.uint64) * Frontier._LayerGeneration.POPCOUNT[eligible])
+            directions = Frontier._LayerGeneration.NTH_BIT[eligible, (draws >> numpy.uint64(32)).astype(numpy.int64)]
+            visited[cells] = True
+            self._links.append((cells, directions))
+
+            return cells
+
+        def _flood(self, layer):
+            # type: (Any) -> Any
+
+            """
+            Explore from the cells of a layer, and return the next layer.
+            """
+
+            visited = self._visited
+            words = self._rng.words(2 * len(layer)).astype(numpy.uint64)
+            orderings = (words[:len(layer)] * numpy.uint64(len(PERMUTATIONS))) >> numpy.uint64(32)
+            counts = (words[len(layer):] * numpy.uint64(5)) >> numpy.uint64(32)
+            explored = Frontier._LayerGeneration.EXPLORED[orderings.astype(numpy.int64), counts.astype(numpy.int64)]
+
+            sources, directions, targets = list(), list(), list()
+            for direction in DIRECTIONS:
+                neighbors, exists = self._neighbors(layer, direction)
+                is_free = exists & ~visited[neighbors]
+                is_explored = (explored >> direction & 1).astype(numpy.bool_)
+                self._tank.append(neighbors[is_free & ~is_explored])
+                chosen = is_free & is_explored
+                sources.append(layer[chosen])
+                directions.append(numpy.full(numpy.count_nonzero(chosen), direction, dtype=numpy.int64))
+                targets.append(neighbors[chosen])
+            sources = numpy.concatenate(sources)
+            directions = numpy.concatenate(directions)
+            targets = numpy.concatenate(targets)
+
+            # Settle the links to the same cell by random priorities: the first link of each cell wins.
+            order = numpy.lexsort((self._rng.words(len(targets)), targets))
+            targets = targets[order]
+            is_first = numpy.concatenate(([True], targets[1:] != targets[:-1])) if len(targets) else targets > 0
+            winners = order[is_first]
+            visited[targets] = True
+            self._links.append((sources[winners], directions[winners]))
+
+            return targets[is_first]
+
+    @staticmethod
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
+
+        if rng is None:
+            rng = RandomSource()
+
+        if parameters and parameters[0] is not None:
+            maze = parameters[0]
+            initial_cell = maze.cell(parameters[1][0], parameters[1][1])
+        else:
+            maze = Maze(width, height, True, False)
+            initial_cell = maze.cell(rng.randrange(width), rng.randrange(height))
+
+        if parameters and len(parameters) > 2 and parameters[2]:
+            return Frontier._LayerGeneration(maze, initial_cell.index(), rng)
+        return Frontier._Generation(maze, initial_cell.index(), rng)
+
+
+class GrowingTree(Algorithm):
     """
-    Randomly flood the space.
+    Grow a tree from a cell: pick an active cell, then link it to a random unvisited neighbor, which becomes active, or
+    deactivate it if it has none. The policy which picks the active cells gives the texture: 'newest' makes long winding
+    passages (like RecursiveBackTracker), 'random' makes many short dead ends (like Prim's algorithm) and 'oldest' makes
+    long straight passages from the start. With a mix of policies, e.g. 'newest:3,random:1' or {'newest': 3,
+    'random': 1}, each pick is made by a policy drawn in proportion of its weight.
 
-    Note that this algorithm can add patches of cells to sub-mazes or neighboring mazes. That is due to the cells in the
-    tank which are connected to cells which have already been visited (but sometimes by other algorithms/mazes).
+    The parameters are (maze, (start_x, start_y), policy). The policy defaults to 'newest'.
     """
 
+    TAKES_MAZE = True
+
+    POLICIES = ('newest', 'random', 'oldest')
+
+    class _Generation(Generation):
+        """
+        The active cells are a list in the order of their activation, whose live part starts at a head: the newest cell
+        is the last one and the oldest one is at the head. A cell deactivated at an end is dropped and one deactivated in
+        the middle is replaced by a tombstone (-1), skipped when it reaches an end. Random picks are drawn again when
+        they hit a tombstone, and the list is compacted when tombstones are half of it, so picks and removals are O(1)
+        amortized for all the policies. One unit of work is one pick.
+        """
+
+        def __init__(self, maze, initial_cell, weights, rng):
+            # type: (Maze, int, Tuple[float, ...], RandomSource) -> None
+
+            Generation.__init__(self, maze)
+            self._rng = rng  # type: RandomSource
+            self._visited = maze.new_visited()  # type: Bitset
+            self._visited.add(initial_cell)
+            self._active = [initial_cell]  # type: List[int]
+            self._head = 0  # type: int
+            self._num_tombstones = 0  # type: int
+            # With a single policy, no draw is needed for choosing it.
+            policies = [policy for policy, weight in enumerate(weights) if weight > 0]
+            self._policy = policies[0]  # type: int
+            self._thresholds = None  # type: Union[Tuple[float, float], None]
+            if len(policies) > 1:
+                self._thresholds = (weights[0] / sum(weights), (weights[0] + weights[1]) / sum(weights))
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            maze = self._maze
+            rng = self._rng
+            visited = self._visited
+            active = self._active
+            head = self._head
+            num_tombstones = self._num_tombstones
+            thresholds = self._thresholds
+            policy = self._policy
+
+            while len(active) > head and budget > 0:
+                budget -= 1
+                if thresholds is not None:
+                    draw = rng.random()
+                    policy = 0 if draw < thresholds[0] else 1 if draw < thresholds[1] else 2
+                if policy == 0:
+                    position = len(active) - 1
+                elif policy == 1:
+                    position = head + rng.randrange(len(active) - head)
+                    while active[position] < 0:
+                        position = head + rng.randrange(len(active) - head)
+                else:
+                    position = head
+
+                cell = active[position]
+                for direction in rng.permutation():
+                    neighbor = maze.neighbor_index(cell, direction)
+                    if neighbor >= 0 and neighbor not in visited:
+                        maze.set_link(cell, direction, True)
+                        visited.add(neighbor)
+                        active.append(neighbor)
+                        break
+                else:
+                    # The ends never hold tombstones: they are skipped as soon as they get there.
+                    if position == len(active) - 1:
+                        active.pop()
+                        while len(active) > head and active[-1] < 0:
+                            active.pop()
+                            num_tombstones -= 1
+                    elif position == head:
+                        head += 1
+                        while active[head] < 0:
+                            head += 1
+                            num_tombstones -= 1
+                    else:
+                        active[position] = -1
+                        num_tombstones += 1
+                        if num_tombstones * 2 > len(active) - head:
+                            active[:] = [cell for cell in active[head:] if cell >= 0]
+                            head = 0
+                            num_tombstones = 0
+                    # Drop the dead part of the list once it is the larger part.
+                    if head > 4096 and head * 2 > len(active):
+                        del active[:head]
+                        head = 0
+
+            self._head = head
+            self._num_tombstones = num_tombstones
+
+            return len(active) > head
+
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
+
+        if rng is None:
+            rng = RandomSource()
 
         if parameters:
             maze = parameters[0]
-            initial_cell = maze.cell(parameters[1][0], parameters[1][1])
+            if maze is None:
+                maze = Maze(width, height, True, False)
+            if parameters[1] is not None:
+                initial_cell = maze.cell(parameters[1][0], parameters[1][1])
+            else:
+                initial_cell = maze.cell(rng.randrange(width), rng.randrange(height))
+            policy = parameters[2] if len(parameters) > 2 else 'newest'
         else:
             maze = Maze(width, height, True, False)
-            initial_cell = maze.cell(random.randrange(width), random.randrange(height))
-
-        initial_cell.set_meta(True)
-        frontier = [initial_cell]
-        tank = set()
-
-        while tank or frontier:
-            # As some directions are ignored, some cells could have been visited but are not. And because some
-            # directions are ignored, not all the space is visited. The tank is the list of cells that could have been
-            # visited but have been ignored. Some of them have actually been visited by another path, so those are
-            # removed.
-            while not frontier and tank:
-                cell = tank.pop()
-                if not cell.get_meta():
-                    # Connect to a random direction that have already been visited.
-                    directions = [direction for direction in Maze.Direction]
-                    random.shuffle(directions)
-                    while directions and not cell.get_meta():
-                        direction = directions.pop()
-                        if cell.has_neighbor(direction) and cell.get_neighbor(direction).get_meta():
-                            cell.open(direction)
-                            cell.set_meta(True)
-                            frontier.append(cell)
-
-            new_frontier = list()
-            while frontier:
-                # Randomly choose a cell from the frontier.
-                cell = random.choice(frontier)
-                frontier.remove(cell)
-
-                # Randomly choose directions to explore.
-                directions = [direction for direction in Maze.Direction]
-                random.shuffle(directions)
-                num_directions = random.randint(0, 4)
-                directions = directions[:num_directions]
-
-                for direction in directions:
-                    if cell.has_neighbor(direction) and not cell.get_neighbor(direction).get_meta():
-                        cell.open(direction)
-                        cell.get_neighbor(direction).set_meta(True)
-                        new_frontier.append(cell.get_neighbor(direction))
-
-                for direction in Maze.Direction:
-                    if direction not in directions and cell.has_neighbor(direction) and not cell.get_neighbor(direction).get_meta():
-                        tank.add(cell.get_neighbor(direction))
-            frontier = new_frontier
-
-        return maze
+            initial_cell = maze.cell(rng.randrange(width), rng.randrange(height))
+            policy = 'newest'
+
+        return GrowingTree._Generation(maze, initial_cell.index(), GrowingTree._parse_policy(policy), rng)
+
+    @staticmethod
+    def _parse_policy(policy):
+        # type: (Any) -> Tuple[float, ...]
+
+        """
+        Return the weights of the policies, in the order of :data:`POLICIES`.
+        """
+
+        if isinstance(policy, str):
+            weights = dict()  # type: Dict[str, float]
+            for part in policy.split(','):
+                name, _, weight = part.strip().partition(':')
+                weights[name] = float(weight) if weight else 1.0
+            policy = weights
+        for name in policy:
+            if name not in GrowingTree.POLICIES:
+                raise ValueError('Unknown policy {}'.format(name))
+        weights = tuple(float(policy.get(name, 0)) for name in GrowingTree.POLICIES)
+        if min(weights) < 0 or sum(weights) <= 0:
+            raise ValueError('Invalid weights of policies {}'.format(policy))
+
+        return weights
 
 
 class HuntAndKill(Algorithm):
@@ -160,78 +835,414 @@ class HuntAndKill(Algorithm):
     a new one, start from a random location on the part of the maze already built.
     """
 
+    TAKES_MAZE = True
+
+    class _Generation(Generation):
+        """
+        One unit of work is one cell of a path.
+        """
+
+        def __init__(self, maze, initial_cell, rng):
+            # type: (Maze, int, RandomSource) -> None
+
+            Generation.__init__(self, maze)
+            self._rng = rng  # type: RandomSource
+            self._visited = maze.new_visited()  # type: Bitset
+            self._current_cell = initial_cell  # type: int
+            self._starting_cells = list()  # type: List[int]
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            maze = self._maze
+            rng = self._rng
+            visited = self._visited
+            starting_cells = self._starting_cells
+            cell = self._current_cell
+
+            while budget > 0:
+                budget -= 1
+                if cell < 0:
+                    if not starting_cells:
+                        break
+                    # Randomly choose a cell of the maze already built, and replace it with the last one.
+                    position = rng.randrange(len(starting_cells))
+                    cell = starting_cells[position]
+                    starting_cells[position] = starting_cells[-1]
+                    starting_cells.pop()
+
+                visited.add(cell)
+                starting_cells.append(cell)
+                for direction in rng.permutation():
+                    neighbor = maze.neighbor_index(cell, direction)
+                    if neighbor >= 0 and neighbor not in visited:
+                        maze.set_link(cell, direction, True)
+                        cell = neighbor
+                        break
+                else:
+                    # The path is complete. Its last cell is the last one added.
+                    starting_cells.pop()
+                    cell = -1
+
+            self._current_cell = cell
+
+            return cell >= 0 or bool(starting_cells)
+
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
 
-        sys.setrecursionlimit(max(sys.getrecursionlimit(), width * height + 10))
+        if rng is None:
+            rng = RandomSource()
 
         if parameters:
             maze = parameters[0]
             initial_cell = maze.cell(parameters[1][0], parameters[1][1])
         else:
             maze = Maze(width, height, True, False)
-            initial_cell = maze.cell(random.randrange(width), random.randrange(height))
+            initial_cell = maze.cell(rng.randrange(width), rng.randrange(height))
+
+        return HuntAndKill._Generation(maze, initial_cell.index(), rng)
+
+
+class Kruskal(Algorithm):
+    """
+    Kruskal's algorithm: the links of the grid are taken in a random order, and each one which joins two separate trees
+    is opened. The mazes are uniform in texture, without the long corridors of the Recursive Back Tracker, and the cost
+    is linear-ish in time and memory, for mazes of tens of millions of cells.
+
+    Needs NumPy.
+    """
+
+    class _Generation(MaskGeneration):
+        """
+        The links are packed into one array of integers (cell * 2, plus 1 for the links down), and their order is given
+        by random ranks: 31 random bits in the high bits, the link in the low bits, so that the ranks are all different.
+        The links stay sorted by cell, so that the lookups of their cells are close to each other in memory. The trees
+        are a union-find of flat arrays.
+
+        The links are merged by rounds, which pick for each tree its link of smallest rank (Boruvka's algorithm): this
+        opens exactly the links Kruskal's algorithm opens one after the other, in the order of the ranks. The links
+        within a tree are dropped, and the parents are fully compressed after each round.
+
+        All the work is done by stages over arrays: drawing the links, then for each round, dropping the links within
+        trees, finding the smallest ranks, picking the links, hooking the trees, compressing the paths of the trees and
+        then the parents of all the cells. A stage goes through its array by slices, writing its results in place, so
+        that a step stops within its budget and the next one resumes the stage. One unit of work is one cell or one link
+        of a stage, then one cell written.
+        """
+
+        NO_LINK = numpy.iinfo(numpy.int64).max if numpy is not None else None
+
+        def __init__(self, maze, rng):
+            # type: (Maze, RandomSource) -> None
+
+            if numpy is None:
+                raise RuntimeError('NumPy is required for Kruskal\'s algorithm')
+
+            MaskGeneration.__init__(self, maze)
+            width = maze.width()
+            height = maze.height()
+            num_cells = width * height
+            index_type = numpy.int32 if 2 * num_cells < 1 << 31 else numpy.int64
+            self._rng = rng  # type: RandomSource
+            self._parents = numpy.arange(num_cells, dtype=index_type)  # type: Any
+            # Smallest rank of the links of each tree during a round, NO_LINK otherwise.
+            self._firsts = numpy.full(num_cells, Kruskal._Generation.NO_LINK, dtype=numpy.int64)  # type: Any
+            self._links = numpy.empty(2 * num_cells - width - height, dtype=index_type)  # type: Any
+            self._ranks = numpy.empty(len(self._links), dtype=numpy.int64)  # type: Any
+            # Roots of the cells of the links, and of their neighbors, during a round.
+            self._roots = None  # type: Any
+            self._neighbor_roots = None  # type: Any
+            self._num_kept = 0  # type: int
+            # Trees of a round, and the trees at the other end of the links they picked.
+            self._trees = numpy.empty(num_cells, dtype=index_type)  # type: Any
+            self._others = numpy.empty(num_cells, dtype=index_type)  # type: Any
+            self._num_trees = 0  # type: int
+            self._has_jumped = False  # type: bool
+            self._cell_masks = numpy.zeros(num_cells, dtype=numpy.uint8)  # type: Any
+            self._stage = '_draw'  # type: Union[str, None]
+            self._stage_position = 0  # type: int
+
+        def _compute_masks(self):
+            # type: () -> bytearray
+
+            return bytearray(self._cell_masks.tobytes())
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            while self._stage is not None and budget > 0:
+                if self._stage in ('_draw', '_compress'):
+                    size = len(self._parents)
+                elif self._stage in ('_hook', '_jump'):
+                    size = self._num_trees
+                else:
+                    size = len(self._links)
+                stop = min(size, self._stage_position + budget)
+                getattr(self, self._stage)(self._stage_position, stop)
+                budget -= stop - self._stage_position
+                self._stage_position = stop
+                if stop == size:
+                    self._stage = self._next_stage()
+                    self._stage_position = 0
+            if self._stage is not None or budget <= 0:
+                return True
+
+            return MaskGeneration._run(self, budget)
+
+        def _next_stage(self):
+            # type: () -> Union[str, None]
+
+            """
+            Finish the current stage, and return the next one, or None once the links are all merged.
+            """
+
+            stage = self._stage
+            if stage == '_filter':
+                num_links = self._num_kept
+                self._num_kept = 0
+                self._links = self._links[:num_links]
+                self._ranks = self._ranks[:num_links]
+                self._roots = self._roots[:num_links]
+                self._neighbor_roots = self._neighbor_roots[:num_links]
+                if not num_links:
+                    self._roots = self._neighbor_roots = None
+                    return None
+                return '_minimum'
+            if stage == '_minimum':
+                return '_pick'
+            if stage == '_pick':
+                return '_hook'
+            if stage == '_hook' or stage == '_jump' and self._has_jumped:
+                # Jump until the paths of the trees are all compressed.
+                self._has_jumped = False
+                return '_jump'
+            if stage == '_jump':
+                return '_compress'
+
+            # After the drawing or a whole round.
+            self._num_trees = 0
+            self._roots = numpy.empty(len(self._links), dtype=self._parents.dtype)
+            self._neighbor_roots = numpy.empty(len(self._links), dtype=self._parents.dtype)
+            return '_filter'
+
+        def _draw(self, start, stop):
+            # type: (int, int) -> None
+
+            """
+            Draw the links of the cells [start, stop) and their ranks.
+            """
+
+            width = self._maze.width()
+            num_cells = len(self._parents)
+            cells = numpy.arange(start, stop, dtype=self._parents.dtype)
+            links = numpy.stack((cells << 1, cells << 1 | 1), axis=1).ravel()
+            exists = numpy.stack((cells % width < width - 1, cells < num_cells - width), axis=1).ravel()
+            links = links[exists]
+            # The links before a cell: those to the right of the cells not in the last column, and those down.
+            position = start - start // width + min(start, num_cells - width)
+            self._links[position:position + len(links)] = links
+            self._ranks[position:position + len(links)] = ((self._rng.words(len(links)) >> 1).astype(numpy.int64) << 32 |
+                                                           links)
+
+        def _filter(self, start, stop):
+            # type: (int, int) -> None
+
+            """
+            Drop the links of [start, stop) within a tree, and find the roots of the others. The links kept are moved to
+            the front of the arrays.
+            """
+
+            width = self._maze.width()
+            links = self._links[start:stop]
+            cells = links >> 1
+            neighbors = cells + 1 + (links & 1) * (width - 1)
+            roots = self._parents[cells]
+            neighbor_roots = self._parents[neighbors]
+            is_between_trees = roots != neighbor_roots
+            position = self._num_kept
+            self._num_kept += int(numpy.count_nonzero(is_between_trees))
+            self._ranks[position:self._num_kept] = self._ranks[start:stop][is_between_trees]
+            self._links[position:self._num_kept] = links[is_between_trees]
+            self._roots[position:self._num_kept] = roots[is_between_trees]
+            self._neighbor_roots[position:self._num_kept] = neighbor_roots[is_between_trees]
+
+        def _minimum(self, start, stop):
+            # type: (int, int) -> None
+
+            ranks = self._ranks[start:stop]
+            numpy.minimum.at(self._firsts, self._roots[start:stop], ranks)
+            numpy.minimum.at(self._firsts, self._neighbor_roots[start:stop], ranks)
+
+        def _pick(self, start, stop):
+            # type: (int, int) -> None
+
+            """
+            Open the links of [start, stop) which are the link of smallest rank of a tree, and record each tree with the
+            tree at the other end of its link.
+            """
+
+            ranks = self._ranks[start:stop]
+            roots = self._roots[start:stop]
+            neighbor_roots = self._neighbor_roots[start:stop]
+            is_first_of_root = ranks == self._firsts[roots]
+            is_first_of_neighbor = ranks == self._firsts[neighbor_roots]
+
+            # A cell has one link to the right and one down, so the cells of a direction are all different.
+            opened = self._links[start:stop][is_first_of_root | is_first_of_neighbor]
+            width = self._maze.width()
+            for direction, offset, is_down in ((RIGHT, 1, 0), (DOWN, width, 1)):
+                cells = opened[(opened & 1) == is_down] >> 1
+                self._cell_masks[cells] |= 1 << direction
+                self._cell_masks[cells + offset] |= 1 << OPPOSITES[direction]
+
+            position = self._num_trees
+            for trees, others, is_picked in ((roots, neighbor_roots, is_first_of_root),
+                                             (neighbor_roots, roots, is_first_of_neighbor)):
+                count = int(numpy.count_nonzero(is_picked))
+                self._trees[position:position + count] = trees[is_picked]
+                self._others[position:position + count] = others[is_picked]
+                position += count
+            self._num_trees = position
+
+        def _hook(self, start, stop):
+            # type: (int, int) -> None
+
+            """
+            Hook each tree to the tree at the other end of its link. Two trees which picked the same link would be
+            hooked to each other: the one with the smallest root stays a root.
+            """
 
-        starting_cells = set()
-        HuntAndKill._recursive(initial_cell, starting_cells)
-        while starting_cells:
-            next_cell = starting_cells.pop()
-            HuntAndKill._recursive(next_cell, starting_cells)
+            trees = self._trees[start:stop]
+            others = self._others[start:stop]
+            is_hooked = (self._firsts[others] != self._firsts[trees]) | (trees > others)
+            self._parents[trees[is_hooked]] = others[is_hooked]
 
-        return maze
+        def _jump(self, start, stop):
+            # type: (int, int) -> None
+
+            """
+            Halve the paths from the trees to their roots, and clear their smallest ranks for the next round.
+            """
+
+            trees = self._trees[start:stop]
+            parents = self._parents[trees]
+            grand_parents = self._parents[parents]
+            if not numpy.array_equal(grand_parents, parents):
+                self._parents[trees] = grand_parents
+                self._has_jumped = True
+            self._firsts[trees] = Kruskal._Generation.NO_LINK
+
+        def _compress(self, start, stop):
+            # type: (int, int) -> None
+
+            """
+            Point the cells [start, stop) to their roots: their parents are roots of the round, which point to theirs.
+            """
+
+            self._parents[start:stop] = self._parents[self._parents[start:stop]]
 
     @staticmethod
-    def _recursive(cell, starting_cells):
-        # type: (Cell, Set[Cell]) -> None
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
 
-        cell.set_meta(True)
-        starting_cells.add(cell)
-        directions = [direction for direction in Maze.Direction]
-        random.shuffle(directions)
-        for direction in directions:
-            if cell.has_neighbor(direction) and not cell.get_neighbor(direction).get_meta():
-                cell.open(direction)
-                HuntAndKill._recursive(cell.get_neighbor(direction), starting_cells)
-                return
-        starting_cells.remove(cell)
+        if rng is None:
+            rng = RandomSource()
+
+        if parameters and parameters[0] is not None:
+            raise ValueError('Kruskal generates its own maze')
+
+        return Kruskal._Generation(Maze(width, height, True, False), rng)
 
 
 class Labyrinth(Algorithm):
     """
     Create a long single path which fills all the space.
+
+    In an empty maze, the path is a serpentine through the rows, computed in closed form. In a maze given as parameter
+    (e.g. with sub-mazes), the path greedily walks from the given cell to the first unvisited neighbor until it is stuck.
     """
 
+    TAKES_MAZE = True
+
+    class _Generation(Generation):
+        """
+        The greedy walk. One unit of work is one cell of the path.
+        """
+
+        def __init__(self, maze, initial_cell):
+            # type: (Maze, int) -> None
+
+            Generation.__init__(self, maze)
+            self._visited = maze.new_visited()  # type: Bitset
+            self._visited.add(initial_cell)
+            self._current_cell = initial_cell  # type: int
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            maze = self._maze
+            visited = self._visited
+            cell = self._current_cell
+
+            while budget > 0:
+                budget -= 1
+                for direction in DIRECTIONS:
+                    neighbor = maze.neighbor_index(cell, direction)
+                    if neighbor >= 0 and neighbor not in visited:
+                        maze.set_link(cell, direction, True)
+                        cell = neighbor
+                        visited.add(cell)
+                        break
+                else:
+                    return False
+
+            self._current_cell = cell
+
+            return True
+
+    class _SerpentineGeneration(MaskGeneration):
+        """
+        The rows are corridors, linked alternately at their right and left ends.
+        """
+
+        def _compute_masks(self):
+            # type: () -> bytearray
+
+            width = self._maze.width()
+            height = self._maze.height()
+            if width > 1:
+                corridor = bytes((1 << RIGHT,)) + bytes((1 << LEFT | 1 << RIGHT,)) * (width - 2) + bytes((1 << LEFT,))
+            else:
+                corridor = bytes(1)
+            masks = bytearray(corridor * height)
+            for y in range(height - 1):
+                turn = y * width + (width - 1 if y % 2 == 0 else 0)
+                masks[turn] |= 1 << DOWN
+                masks[turn + width] |= 1 << UP
+
+            return masks
+
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
 
         if parameters:
             maze = parameters[0]
             initial_cell = maze.cell(parameters[1][0], parameters[1][1])
-        else:
-            maze = Maze(width, height, True, False)
-            initial_cell = maze.cell(random.randrange(width), random.randrange(height))
-
-        cell = initial_cell
-        cell.set_meta(True)
-        done = False
-        while not done:
-            done = True
-            for direction in Maze.Direction:
-                if cell.has_neighbor(direction) and not cell.get_neighbor(direction).get_meta():
-                    cell.open(direction)
-                    cell = cell.get_neighbor(direction)
-                    cell.set_meta(True)
-                    done = False
-                    break
+            return Labyrinth._Generation(maze, initial_cell.index())
 
-        return maze
+        return Labyrinth._SerpentineGeneration(Maze(width, height, True, False))
 
 
 class Labyrinth2(Algorithm):
     """
     Create a long single path which fills all the space.
+
+    The parameters are (None, None, algorithm). With an algorithm, the path is not grown by expansions: the algorithm
+    makes a tree on a lattice of half the resolution, and the path goes around that tree, through the 2x2 blocks of cells
+    of the lattice cells, in one vectorized pass (see :class:`Labyrinth2._LatticeGeneration`).
     """
 
     class Expansion(object):
@@ -242,31 +1253,32 @@ class Labyrinth2(Algorithm):
         called in that case.
         """
 
-        def __init__(self, origin_cell, direction, perpendicular_direction):
-            # type: (Cell, Maze.Direction, Maze.Direction) -> None
+        def __init__(self, origin_cell, direction, perpendicular_direction, visited):
+            # type: (Cell, int, int, Bitset) -> None
 
-            self._direction = direction  # type: Maze.Direction
+            self._direction = direction  # type: int
             self._origin = origin_cell  # type: Cell
             self._origin_expanded = None  # type: Union[Cell, None]
             self._paired = None  # type: Union[Cell, None]
             self._paired_expanded = None  # type: Union[Cell, None]
-            self._perpendicular = perpendicular_direction  # type: Maze.Direction
+            self._perpendicular = perpendicular_direction  # type: int
+            self._visited = visited  # type: Bitset
             self._is_possible = self._resolve()  # type: bool
 
         def do_expansion(self):
             # type: () -> None
 
-            self._origin.close(self._direction)
-            self._origin.open(self._perpendicular)
-            self._paired.open(self._perpendicular)
-            self._origin_expanded.open(self._direction)
-            self._origin_expanded.set_meta(True)
-            self._paired_expanded.set_meta(True)
+            self._origin.close_at(self._direction)
+            self._origin.open_at(self._perpendicular)
+            self._paired.open_at(self._perpendicular)
+            self._origin_expanded.open_at(self._direction)
+            self._visited.add(self._origin_expanded.index())
+            self._visited.add(self._paired_expanded.index())
 
         def get_cells(self):
-            # type: () -> Set[Cell]
+            # type: () -> Tuple[Cell, ...]
 
-            return {self._origin, self._paired, self._origin_expanded, self._paired_expanded}
+            return self._origin, self._paired, self._origin_expanded, self._paired_expanded
 
         def is_possible(self):
             # type: () -> bool
@@ -277,20 +1289,23 @@ class Labyrinth2(Algorithm):
             # type: () -> bool
 
             # Select paired cell.
-            if self._origin.has_neighbor(self._direction) and self._origin.get_neighbor(self._direction).get_meta() and self._origin.is_open(self._direction):
-                self._paired = self._origin.get_neighbor(self._direction)
+            paired = self._origin.neighbor_at(self._direction)
+            if paired is not None and paired.index() in self._visited and self._origin.is_open_at(self._direction):
+                self._paired = paired
             else:
                 return False
 
             # Select first expansion cell.
-            if self._origin.has_neighbor(self._perpendicular) and not self._origin.get_neighbor(self._perpendicular).get_meta():
-                self._origin_expanded = self._origin.get_neighbor(self._perpendicular)
+            origin_expanded = self._origin.neighbor_at(self._perpendicular)
+            if origin_expanded is not None and origin_expanded.index() not in self._visited:
+                self._origin_expanded = origin_expanded
             else:
                 return False
 
             # Select second expansion cell.
-            if self._paired.has_neighbor(self._perpendicular) and not self._paired.get_neighbor(self._perpendicular).get_meta():
-                self._paired_expanded = self._paired.get_neighbor(self._perpendicular)
+            paired_expanded = self._paired.neighbor_at(self._perpendicular)
+            if paired_expanded is not None and paired_expanded.index() not in self._visited:
+                self._paired_expanded = paired_expanded
             else:
                 return False
             """
@@ -311,180 +1326,323 @@ class Labyrinth2(Algorithm):
             return ((is_even or is_stuck) and evens_or_odds) or is_surrounded
             """
             # Check if the expansion is surrounded (stuck from both sides).
-            if Labyrinth2._is_zero(self._origin_expanded, self._direction.opposite()) and Labyrinth2._is_zero(self._paired_expanded, self._direction):
+            if Labyrinth2._is_zero(self._origin_expanded, OPPOSITES[self._direction], self._visited) and Labyrinth2._is_zero(self._paired_expanded, self._direction, self._visited):
                 return True
 
             # In the direction of the expansion, it is fine if the expansion completely shuts off a corridor and goes along a wall.
-            if Labyrinth2._is_zero(self._origin_expanded, self._perpendicular) and Labyrinth2._is_zero(self._paired_expanded, self._perpendicular) \
-                    and (Labyrinth2._is_zero(self._origin_expanded, self._direction.opposite() or Labyrinth2._is_zero(self._paired_expanded, self._direction))):
+            if Labyrinth2._is_zero(self._origin_expanded, self._perpendicular, self._visited) and Labyrinth2._is_zero(self._paired_expanded, self._perpendicular, self._visited) \
+                    and Labyrinth2._is_zero(self._origin_expanded, OPPOSITES[self._direction], self._visited):
                 return True
 
             # Check that the expanded cells are at even distance from the edges or cells of the paths.
-            if not Labyrinth2._is_even(self._origin_expanded, self._direction.opposite()):
+            if not Labyrinth2._is_even(self._origin_expanded, OPPOSITES[self._direction], self._visited):
                 return False
-            if not Labyrinth2._is_even(self._paired_expanded, self._direction):
+            if not Labyrinth2._is_even(self._paired_expanded, self._direction, self._visited):
                 return False
 
             # Check that in the direction of the expansion, the counts are either all evens or all odds.
-            if Labyrinth2._is_even(self._origin_expanded, self._perpendicular) is not Labyrinth2._is_even(self._paired_expanded, self._perpendicular):
+            if Labyrinth2._is_even(self._origin_expanded, self._perpendicular, self._visited) is not Labyrinth2._is_even(self._paired_expanded, self._perpendicular, self._visited):
                 return False
 
             return True
 
         @staticmethod
-        def _distance_one(cell, direction):
-            # type: (Cell, Maze.Direction) -> bool
+        def _distance_one(cell, direction, visited):
+            # type: (Cell, int, Bitset) -> bool
 
-            if not cell.has_neighbor(direction):
+            neighbor = cell.neighbor_at(direction)
+            if neighbor is None or neighbor.index() in visited:
                 return False
 
-            neighbor = cell.get_neighbor(direction)
-            if neighbor.get_meta():
-                return False
+            next_neighbor = neighbor.neighbor_at(direction)
+            return next_neighbor is None or next_neighbor.index() in visited
 
-            return not neighbor.has_neighbor(direction) or neighbor.get_neighbor(direction).get_meta()
+    class _Generation(Generation):
+        """
+        One unit of work is one lookup for an expansion from a random cell of the frontier.
+        """
 
-    @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+        def __init__(self, maze, rng):
+            # type: (Maze, RandomSource) -> None
 
-        # FIXME: support that. Plus, only even dimensions are supported.
-        if parameters:
-            raise RuntimeError('parameters not supported')
+            Generation.__init__(self, maze)
+            self._rng = rng  # type: RandomSource
+            self._visited = maze.new_visited()  # type: Bitset
+            self._frontier = None  # type: Union[Dict[Cell, None], None]
+            self._tank = dict()  # type: Dict[Cell, None]
 
-        maze = Maze(width, height, True, False)
-        initial_cell = maze.cell(0, 0)
+        def _run(self, budget):
+            # type: (int) -> bool
 
-        try:
-            frontier = Labyrinth2._initial_path(initial_cell)
-            tank = set()
-            while frontier or tank:
+            rng = self._rng
+            visited = self._visited
+            if self._frontier is None:
+                self._frontier = Labyrinth2._initial_path(self._maze.cell(0, 0), visited, rng)
+                budget -= 1
+            frontier = self._frontier
+            tank = self._tank
+
+            while (frontier or tank) and budget > 0:
+                budget -= 1
                 if not frontier:
                     frontier.update(tank)
                     tank.clear()
-                random_cell = random.choice(list(frontier))
-                expansion = Labyrinth2._find_expansion(random_cell)
+                random_cell = rng.choice(list(frontier))
+                expansion = Labyrinth2._find_expansion(random_cell, visited, rng)
                 if expansion:
                     expansion.do_expansion()
                     for cell in expansion.get_cells():
-                        if Labyrinth2._is_frontier(cell):
-                            frontier.add(cell)
+                        if Labyrinth2._is_frontier(cell, visited):
+                            frontier[cell] = None
                         else:
-                            frontier.discard(cell)
+                            frontier.pop(cell, None)
                 else:
-                    frontier.discard(random_cell)
-                    if Labyrinth2._is_frontier(random_cell):
-                        tank.add(random_cell)
+                    frontier.pop(random_cell, None)
+                    if Labyrinth2._is_frontier(random_cell, visited):
+                        tank[random_cell] = None
+
+            return bool(frontier or tank)
+
+    class _LatticeGeneration(LatticeGeneration):
+        """
+        Each cell of the lattice is a block of 2x2 cells. The path goes along the sides of the block which have no link
+        in the lattice, and crosses to the neighbor blocks along the links: around the tree, it makes a cycle through
+        all the cells, which is cut at the first block into a path.
+        """
+
+        def _expand(self, masks):
+            # type: (Any) -> Any
+
+            left, up, right, down = (masks >> direction & 1 for direction in DIRECTIONS)
+            full_masks = numpy.empty((2 * masks.shape[0], 2 * masks.shape[1]), dtype=numpy.uint8)
+            full_masks[0::2, 0::2] = (1 - up) << RIGHT | (1 - left) << DOWN | up << UP | left << LEFT
+            full_masks[0::2, 1::2] = (1 - up) << LEFT | (1 - right) << DOWN | up << UP | right << RIGHT
+            full_masks[1::2, 0::2] = (1 - down) << RIGHT | (1 - left) << UP | down << DOWN | left << LEFT
+            full_masks[1::2, 1::2] = (1 - down) << LEFT | (1 - right) << UP | down << DOWN | right << RIGHT
+            # The first block has no link to the left, so its cells are linked on the left side: cut the cycle there.
+            full_masks[0, 0] ^= 1 << DOWN
+            full_masks[1, 0] ^= 1 << UP
+
+            return full_masks
+
+    @classmethod
+    def run(cls, width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Tuple[Maze, bool]
+
+        generation = Labyrinth2.start(width, height, parameters, rng)
+        try:
+            generation.finish()
         except KeyboardInterrupt:
-            return maze, False
+            return generation.maze(), False
+
+        return generation.maze(), True
+
+    @staticmethod
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
+
+        if rng is None:
+            rng = RandomSource()
 
-        return maze, True
+        if parameters and len(parameters) > 2 and parameters[2] is not None:
+            if parameters[0] is not None or parameters[1] is not None:
+                raise ValueError('The lattice mode generates its own maze')
+            if width % 2 or height % 2:
+                raise ValueError('The lattice mode needs even dimensions, not {}x{}'.format(width, height))
+            lattice_generation = parameters[2].start(width // 2, height // 2, None, rng)
+            return Labyrinth2._LatticeGeneration(Maze(width, height, True, False), lattice_generation)
+
+        # FIXME: support that. Plus, only even dimensions are supported.
+        if parameters:
+            raise RuntimeError('parameters not supported')
+
+        return Labyrinth2._Generation(Maze(width, height, True, False), rng)
 
     @staticmethod
-    def _initial_path(cell):
-        # type: (Cell) -> Set[Cell]
-
-        directions = set()
-        for direction in Maze.Direction:
-            if cell.has_neighbor(direction):
-                directions.add(direction)
-
-        direction = random.choice(list(directions))
-        frontier = {cell}
-        cell.set_meta(True)
-        while cell.has_neighbor(direction):
-            cell.open(direction)
-            cell = cell.get_neighbor(direction)
-            cell.set_meta(True)
-            frontier.add(cell)
+    def _initial_path(cell, visited, rng):
+        # type: (Cell, Bitset, RandomSource) -> Dict[Cell, None]
+
+        direction = rng.choice([direction for direction in DIRECTIONS if cell.neighbor_at(direction) is not None])
+        frontier = {cell: None}
+        visited.add(cell.index())
+        while cell.neighbor_at(direction) is not None:
+            cell.open_at(direction)
+            cell = cell.neighbor_at(direction)
+            visited.add(cell.index())
+            frontier[cell] = None
 
         return frontier
 
     @staticmethod
-    def _is_even(cell, direction):
-        # type: (Cell, Maze.Direction) -> bool
+    def _is_even(cell, direction, visited):
+        # type: (Cell, int, Bitset) -> bool
 
         count = 0
-        while cell.has_neighbor(direction) and not cell.get_neighbor(direction).get_meta():
+        neighbor = cell.neighbor_at(direction)
+        while neighbor is not None and neighbor.index() not in visited:
             count += 1
-            cell = cell.get_neighbor(direction)
+            neighbor = neighbor.neighbor_at(direction)
 
-        return count % 2 is 0
+        return count % 2 == 0
 
     @staticmethod
-    def _is_frontier(cell):
-        # type: (Cell) -> bool
+    def _is_frontier(cell, visited):
+        # type: (Cell, Bitset) -> bool
 
-        for direction in Maze.Direction:
-            if cell.has_neighbor(direction) and not cell.get_neighbor(direction).get_meta():
+        for direction in DIRECTIONS:
+            neighbor = cell.neighbor_at(direction)
+            if neighbor is not None and neighbor.index() not in visited:
                 return True
 
         return False
 
     @staticmethod
-    def _is_zero(cell, direction):
-        # type: (Cell, Maze.Direction) -> bool
+    def _is_zero(cell, direction, visited):
+        # type: (Cell, int, Bitset) -> bool
 
-        if not cell.has_neighbor(direction):
+        neighbor = cell.neighbor_at(direction)
+        if neighbor is None:
             return True
 
-        return cell.get_neighbor(direction).get_meta()
+        return neighbor.index() in visited
 
     @staticmethod
-    def _find_expansion(cell):
-        # type: (Cell) -> Union[Labyrinth2.Expansion, None]
+    def _find_expansion(cell, visited, rng):
+        # type: (Cell, Bitset, RandomSource) -> Union[Labyrinth2.Expansion, None]
 
         # Return the first expansion found. Lookup directions in a randomized order.
-        for direction in Maze.Direction.shuffle():  # TODO: Add a random() method to Maze.Direction returning an randomly ordered set.
-            for perpendicular_direction in direction.perpendiculars():
-                expansion = Labyrinth2.Expansion(cell, direction, perpendicular_direction)
+        for direction in rng.permutation():
+            for perpendicular_direction in PERPENDICULARS[direction]:
+                expansion = Labyrinth2.Expansion(cell, direction, perpendicular_direction, visited)
                 if expansion.is_possible():
                     return expansion
 
         return None
 
 
+class Lattice(Algorithm):
+    """
+    Run an algorithm on a lattice of half the resolution, and make an "even" maze of it: the cells of the lattice are
+    the cells of the maze at even coordinates, and their links go through the cells between them. The other cells are
+    left out, as walls. This is the layout :class:`RecursiveBackTracker2` makes, for about a fourth of the cell visits.
+
+    The parameters are (algorithm, parameters of the algorithm). The algorithm defaults to RecursiveBackTracker.
+    """
+
+    class _Generation(LatticeGeneration):
+
+        def _expand(self, masks):
+            # type: (Any) -> Any
+
+            height = self._maze.height()
+            width = self._maze.width()
+            full_masks = numpy.zeros((height, width), dtype=numpy.uint8)
+            full_masks[0::2, 0::2] = masks
+            # The cells between two cells of the lattice are open on both sides when the cells are linked.
+            full_masks[0::2, 1::2] = numpy.where(masks[:, :width // 2] >> RIGHT & 1, 1 << LEFT | 1 << RIGHT, 0)
+            full_masks[1::2, 0::2] = numpy.where(masks[:height // 2] >> DOWN & 1, 1 << UP | 1 << DOWN, 0)
+
+            return full_masks
+
+    @staticmethod
+    def lattice_size(width, height):
+        # type: (int, int) -> Tuple[int, int]
+
+        return (width + 1) // 2, (height + 1) // 2
+
+    @staticmethod
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
+
+        if rng is None:
+            rng = RandomSource()
+
+        algorithm = parameters[0] if parameters and parameters[0] is not None else RecursiveBackTracker
+        algorithm_parameters = parameters[1] if parameters and len(parameters) > 1 else None
+        lattice_width, lattice_height = Lattice.lattice_size(width, height)
+        lattice_generation = algorithm.start(lattice_width, lattice_height, algorithm_parameters, rng)
+
+        return Lattice._Generation(Maze(width, height, True, False), lattice_generation)
+
+
 class Passage(Algorithm):
     """
-    Make a passage between two points.
+    Make a passage between two points: a random monotone path, whose horizontal and vertical steps are shuffled together
+    so that the path follows the direction of the end point all along.
+
+    The parameters are (maze, (start_x, start_y), (end_x, end_y)). If a maze is given, the passage is carved directly
+    into it, between points in its coordinates, and its cells are added to the sub-maze cells of the maze so that the
+    algorithms run afterwards on the maze leave it alone.
     """
 
+    TAKES_MAZE = True
+
+    class _Generation(Generation):
+        """
+        The steps of the path are drawn at once, and carved by batches. One unit of work is one step of the passage.
+        """
+
+        def __init__(self, maze, start_x, start_y, steps, is_embedded):
+            # type: (Maze, int, int, bytearray, bool) -> None
+
+            Generation.__init__(self, maze)
+            self._x = start_x  # type: int
+            self._y = start_y  # type: int
+            self._steps = steps  # type: bytearray
+            self._position = 0  # type: int
+            self._is_embedded = is_embedded  # type: bool
+            if is_embedded:
+                maze.sub_maze_cells().add(start_y * maze.width() + start_x)
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            maze = self._maze
+            x = self._x
+            y = self._y
+            stop = min(len(self._steps), self._position + budget)
+
+            edges = list()  # type: List[Tuple[int, int, int]]
+            for direction in self._steps[self._position:stop]:
+                edges.append((x, y, direction))
+                x += DX[direction]
+                y += DY[direction]
+            maze.carve(edges)
+            if self._is_embedded:
+                sub_maze_cells = maze.sub_maze_cells()
+                width = maze.width()
+                for edge_x, edge_y, direction in edges:
+                    sub_maze_cells.add((edge_y + DY[direction]) * width + edge_x + DX[direction])
+
+            self._x = x
+            self._y = y
+            self._position = stop
+
+            return stop < len(self._steps)
+
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
+
+        if rng is None:
+            rng = RandomSource()
 
         if not parameters:
             raise RuntimeError('{} needs two points'.format(Passage.__name__))
 
-        maze = Maze(width, height, True, False)
-
         # TODO: Parameters here are special: (maze, (start_x, start_y), (end_x, end_y))
+        maze = parameters[0]
+        is_embedded = maze is not None
+        if not is_embedded:
+            maze = Maze(width, height, True, False)
         start_cell = maze.cell(parameters[1][0], parameters[1][1])
         end_cell = maze.cell(parameters[2][0], parameters[2][1])
 
-        directions = set()
-        if start_cell.x() < end_cell.x():
-            directions.add(Maze.Direction.RIGHT)
-        elif start_cell.x() > end_cell.x():
-            directions.add(Maze.Direction.LEFT)
-        if start_cell.y() < end_cell.y():
-            directions.add(Maze.Direction.DOWN)
-        elif start_cell.y() > end_cell.y():
-            directions.add(Maze.Direction.UP)
-        current_cell = start_cell
-        current_cell.set_meta(True)
-
-        while current_cell is not end_cell:
-            # TODO: Respect the ratio when drawing random direction.
-            direction = random.choice(tuple(directions))
-            if current_cell.has_neighbor(direction):
-                current_cell.open(direction)
-                current_cell = current_cell.get_neighbor(direction)
-                current_cell.set_meta(True)
-            else:
-                directions.remove(direction)
+        steps = (bytearray((RIGHT if start_cell.x() < end_cell.x() else LEFT,)) * abs(end_cell.x() - start_cell.x()) +
+                 bytearray((DOWN if start_cell.y() < end_cell.y() else UP,)) * abs(end_cell.y() - start_cell.y()))
+        rng.shuffle(steps)
 
-        return maze
+        return Passage._Generation(maze, start_cell.x(), start_cell.y(), steps, is_embedded)
 
 
 class RecursiveBackTracker(Algorithm):
@@ -492,170 +1650,371 @@ class RecursiveBackTracker(Algorithm):
     The original Recursive Back Tracker algorithm.
     """
 
+    TAKES_MAZE = True
+
+    class _Generation(Generation):
+        """
+        The recursion is unrolled into a stack of [cell, directions, position of the next direction to try]. One unit of
+        work is one move forward or backward on the stack.
+        """
+
+        def __init__(self, maze, initial_cell, rng):
+            # type: (Maze, int, RandomSource) -> None
+
+            Generation.__init__(self, maze)
+            self._rng = rng  # type: RandomSource
+            self._visited = maze.new_visited()  # type: Bitset
+            self._visited.add(initial_cell)
+            self._stack = [[initial_cell, rng.permutation(), 0]]  # type: List[List[Any]]
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            maze = self._maze
+            rng = self._rng
+            visited = self._visited
+            stack = self._stack
+
+            while stack and budget > 0:
+                budget -= 1
+                frame = stack[-1]
+                cell, directions, position = frame
+                while position < 4:
+                    direction = directions[position]
+                    position += 1
+                    neighbor = maze.neighbor_index(cell, direction)
+                    if neighbor >= 0 and neighbor not in visited:
+                        maze.set_link(cell, direction, True)
+                        visited.add(neighbor)
+                        frame[2] = position
+                        stack.append([neighbor, rng.permutation(), 0])
+                        break
+                else:
+                    stack.pop()
+
+            return bool(stack)
+
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
 
-        sys.setrecursionlimit(max(sys.getrecursionlimit(), width * height + 10))
+        if rng is None:
+            rng = RandomSource()
 
         if parameters:
             maze = parameters[0]
             initial_cell = maze.cell(parameters[1][0], parameters[1][1])
         else:
             maze = Maze(width, height, True, False)
-            initial_cell = maze.cell(random.randrange(width), random.randrange(height))
-
-        RecursiveBackTracker._recursive(initial_cell)
-
-        return maze
-
-    @staticmethod
-    def _recursive(cell):
-        # type: (Cell) -> None
+            initial_cell = maze.cell(rng.randrange(width), rng.randrange(height))
 
-        cell.set_meta(True)
-        directions = [direction for direction in Maze.Direction]
-        random.shuffle(directions)
-        for direction in directions:
-            if cell.has_neighbor(direction) and not cell.get_neighbor(direction).get_meta():
-                cell.open(direction)
-                RecursiveBackTracker._recursive(cell.get_neighbor(direction))
+        return RecursiveBackTracker._Generation(maze, initial_cell.index(), rng)
 
 
 class RecursiveBackTracker2(Algorithm):
     """
     Variation of the Recursive Back Tracker algorithm which occupies half of the grid. It is "even".
 
-    TODO: Achieve the same thing with a regular Recursive Back Tracker algorithm and a smart grid/maze which handles
-    TODO: the "even" distribution itself. Algorithms could be combined.
+    The parameters are (maze, (start_x, start_y), lattice). With 'lattice' and no maze, a regular Recursive Back Tracker
+    runs on a lattice of half the resolution which handles the "even" distribution itself (see :class:`Lattice`), instead
+    of visiting and rejecting the cells next to the path.
 
     This algorithm is a basis for the generation of labyrinths.
     """
 
+    TAKES_MAZE = True
+
+    class _Generation(Generation):
+        """
+        The recursion is unrolled into a stack of [cell, directions, position of the next direction to try, count since
+        last turn]. One unit of work is one move forward or backward on the stack.
+        """
+
+        def __init__(self, maze, initial_cell, rng):
+            # type: (Maze, int, RandomSource) -> None
+
+            Generation.__init__(self, maze)
+            self._rng = rng  # type: RandomSource
+            self._visited = maze.new_visited()  # type: Bitset
+            self._visited.add(initial_cell)
+            self._stack = [[initial_cell, rng.permutation(), 0, 0]]  # type: List[List[Any]]
+
+        def _run(self, budget):
+            # type: (int) -> bool
+
+            maze = self._maze
+            rng = self._rng
+            visited = self._visited
+            stack = self._stack
+
+            while stack and budget > 0:
+                budget -= 1
+                frame = stack[-1]
+                cell, directions, position, count_since_last_turn = frame
+                while position < len(directions):
+                    direction = directions[position]
+                    position += 1
+                    neighbor = maze.neighbor_index(cell, direction)
+                    if neighbor >= 0 and neighbor not in visited:
+                        for neighbor_direction in OTHERS[OPPOSITES[direction]]:
+                            next_neighbor = maze.neighbor_index(neighbor, neighbor_direction)
+                            if next_neighbor >= 0 and next_neighbor in visited:
+                                break
+                        else:
+                            maze.set_link(cell, direction, True)
+                            visited.add(neighbor)
+                            frame[2] = position
+                            if (count_since_last_turn + 1) % 2 == 0:
+                                stack.append([neighbor, rng.permutation(), 0, count_since_last_turn + 1])
+                            else:
+                                stack.append([neighbor, (direction,), 0, count_since_last_turn + 1])
+                            break
+                else:
+                    stack.pop()
+
+            return bool(stack)
+
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
+
+        if rng is None:
+            rng = RandomSource()
 
-        sys.setrecursionlimit(max(sys.getrecursionlimit(), width * height + 10))
+        if parameters and len(parameters) > 2 and parameters[2]:
+            if parameters[0] is not None:
+                raise ValueError('The lattice mode generates its own maze')
+            lattice_width, lattice_height = Lattice.lattice_size(width, height)
+            start = None
+            if parameters[1] is not None:
+                start = (Maze(lattice_width, lattice_height, True, False), (parameters[1][0] // 2, parameters[1][1] // 2))
+            return Lattice.start(width, height, (RecursiveBackTracker, start), rng)
 
         if parameters:
             maze = parameters[0]
             initial_cell = maze.cell(parameters[1][0], parameters[1][1])
         else:
             maze = Maze(width, height, True, False)
-            initial_cell = maze.cell(random.randrange(width), random.randrange(height))
+            initial_cell = maze.cell(rng.randrange(width), rng.randrange(height))
 
-        RecursiveBackTracker2._recursive(initial_cell, None, 0)
+        return RecursiveBackTracker2._Generation(maze, initial_cell.index(), rng)
 
-        return maze
+
+class Room(Algorithm):
+    """
+    An empty maze, no walls excepted the surrounding walls (and maybe the pillars depending on the rendering engine).
+    """
 
     @staticmethod
-    def _recursive(cell, last_direction, count_since_last_turn):
-        # type: (Cell, Union[Maze.Direction, None], int) -> None
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
 
-        cell.set_meta(True)
-        if count_since_last_turn % 2 is 0:
-            directions = [direction for direction in Maze.Direction]
-            random.shuffle(directions)
-        else:
-            directions = {last_direction}
-        for direction in directions:
-            if cell.has_neighbor(direction) and not cell.get_neighbor(direction).get_meta():
-                neighbor = cell.get_neighbor(direction)
-                for neighbor_direction in direction.opposite().others():
-                    if neighbor.has_neighbor(neighbor_direction) and neighbor.get_neighbor(neighbor_direction).get_meta():
-                        break
-                else:
-                    cell.open(direction)
-                    RecursiveBackTracker2._recursive(cell.get_neighbor(direction), direction, count_since_last_turn + 1)
+        return Generation(Maze(width, height, False, True))
 
 
-class Room(Algorithm):
+class Sidewinder(Algorithm):
     """
-    An empty maze, no walls excepted the surrounding walls (and maybe the pillars depending on the rendering engine).
+    Each row is cut in runs of cells linked right, at random, and one random cell of each run is linked up. The first
+    row is a single corridor. Fast, but the maze is biased: there is no dead end upwards and the top row is a corridor.
+
+    Needs NumPy.
     """
 
+    class _Generation(RowGeneration):
+        def _carve(self, y, num_rows):
+            # type: (int, int) -> Tuple[Any, Any]
+
+            width = self._maze.width()
+            num_cells = num_rows * width
+
+            # One word per cell, so that the draws do not depend on the blocks: its lowest bit closes the run at the
+            # cell, and the other bits of the word of the last cell of a run pick the cell of the run which is linked up.
+            words = self._rng.words(num_cells)
+
+            # Close the runs at random, and at the end of the rows.
+            ends = (words.reshape(num_rows, width) & 1).astype(bool)
+            ends[:, -1] = True
+            if y == 0:
+                ends[0, :-1] = False
+            right = ~ends
+
+            # Link a random cell of each run up.
+            run_ends = numpy.flatnonzero(ends)
+            run_starts = numpy.empty_like(run_ends)
+            run_starts[0] = 0
+            run_starts[1:] = run_ends[:-1] + 1
+            lengths = (run_ends - run_starts + 1).astype(numpy.uint64)
+            offsets = ((words[run_ends] >> 1).astype(numpy.uint64) * lengths) >> numpy.uint64(31)
+            up = numpy.zeros(num_cells, dtype=bool)
+            up[run_starts + offsets.astype(run_starts.dtype)] = True
+            up = up.reshape(num_rows, width)
+            if y == 0:
+                up[0] = False
+
+            return up, right
+
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
+
+        if rng is None:
+            rng = RandomSource()
 
-        return Maze(width, height, False, True)
+        if parameters and parameters[0] is not None:
+            raise ValueError('Sidewinder generates its own maze')
+
+        return Sidewinder._Generation(Maze(width, height, True, False), rng)
 
 
 class Spiral(Algorithm):
     """
-    A spiral with one, two, three or four exits. The spiral can be rectangular and the positions of the exits can be
-    chosen.
+    A spiral with one, two, three or four exits at the corners. The spiral can be any rectangle.
+
+    The spiral is made of rings, from the border to the center. The exits split each ring in passages, from an exit
+    corner to the next one (clockwise, or counterclockwise), and each passage continues on the next ring from the corner
+    next to its end: there is one passage per exit, winding to the center. There, the passages are joined so that all
+    the exits are connected.
     """
-    # TODO: Improve, 13x14 not well supported, 2 or 3 exits not well supported.
+
+    class _Generation(MaskGeneration):
+        def __init__(self, maze, corners, is_clockwise):
+            # type: (Maze, List[int], bool) -> None
+
+            MaskGeneration.__init__(self, maze)
+            self._corners = corners  # type: List[int]
+            self._is_clockwise = is_clockwise  # type: bool
+
+        def _compute_masks(self):
+            # type: () -> bytearray
+
+            width = self._maze.width()
+            height = self._maze.height()
+            corners = self._corners
+            masks = bytearray(width * height)
+
+            # The spiral is computed clockwise, and mirrored if it is counterclockwise.
+            mirror_x = 0 if self._is_clockwise else width - 1
+
+            def link(x, y, other_x, other_y):
+                # type: (int, int, int, int) -> None
+
+                """
+                Link all the cells of the straight passage between two cells, with one translation of the masks per
+                direction.
+                """
+
+                x, other_x = sorted((abs(mirror_x - x), abs(mirror_x - other_x)))
+                y, other_y = sorted((y, other_y))
+                first = y * width + x
+                if y == other_y:
+                    last, step, directions = y * width + other_x, 1, (RIGHT, LEFT)
+                else:
+                    last, step, directions = other_y * width + x, width, (DOWN, UP)
+                masks[first:last:step] = masks[first:last:step].translate(LINK_TABLES[directions[0]])
+                masks[first + step:last + 1:step] = masks[first + step:last + 1:step].translate(
+                    LINK_TABLES[directions[1]])
+
+            def cut(x, y, other_x, other_y):
+                # type: (int, int, int, int) -> None
+
+                x, other_x = abs(mirror_x - x), abs(mirror_x - other_x)
+                if y == other_y:
+                    direction = RIGHT if other_x > x else LEFT
+                else:
+                    direction = DOWN if other_y > y else UP
+                masks[y * width + x] &= ~(1 << direction)
+                masks[other_y * width + other_x] &= ~(1 << OPPOSITES[direction])
+
+            # Each ring is linked all around, then cut before each exit corner: the passages go from a corner to the
+            # next one. Corners are numbered clockwise from the top left one. The end of a passage, just before a
+            # corner of its ring, is next to the same corner of the next ring.
+            x0, y0, x1, y1 = 0, 0, width - 1, height - 1
+            ends = list()  # type: List[Tuple[int, int, int]]
+            while x0 < x1 and y0 < y1:
+                corner_cells = ((x0, y0), (x1, y0), (x1, y1), (x0, y1))
+                for x, y, corner in ends:
+                    link(*((x, y) + corner_cells[corner]))
+
+                link(x0, y0, x1, y0)
+                link(x1, y0, x1, y1)
+                link(x0, y1, x1, y1)
+                link(x0, y0, x0, y1)
+
+                # On the last ring, the passages are joined: only the cut before the first corner is kept.
+                is_last = x1 - x0 < 2 or y1 - y0 < 2
+                before_corners = ((x0, y0 + 1), (x1 - 1, y0), (x1, y1 - 1), (x0 + 1, y1))
+                ends = [before_corners[corner] + (corner,) for corner in corners]
+                for x, y, corner in ends[:1] if is_last else ends:
+                    cut(*((x, y) + corner_cells[corner]))
+
+                x0, y0, x1, y1 = x0 + 1, y0 + 1, x1 - 1, y1 - 1
+
+            if x0 <= x1 and y0 <= y1:
+                # A line is left at the center: it is one more passage, and all the others join it.
+                link(x0, y0, x1, y1)
+                corner_cells = ((x0, y0), (x1, y0), (x1, y1), (x0, y1))
+                for x, y, corner in ends:
+                    link(*((x, y) + corner_cells[corner]))
+
+            return masks
 
     @staticmethod
-    def run(width, height, parameters=None):
-        # type: (int, int, Any) -> Maze
+    def start(width, height, parameters=None, rng=None):
+        # type: (int, int, Any, RandomSource) -> Generation
 
         if not parameters:
-            raise RuntimeError('{} needs positions of the exits'.format(Passage.__name__))
-
-        maze = Maze(width, height, True, False)
+            raise RuntimeError('{} needs positions of the exits'.format(Spiral.__name__))
 
         # TODO: Parameters here are special: (maze, [(exit1_x, exit1_y), (exit2_x, exit2_y), ...], is_clockwise)
         exits = parameters[1]
         is_clockwise = parameters[2]
 
-        if is_clockwise:
-            directions = [Maze.Direction.LEFT, Maze.Direction.UP, Maze.Direction.RIGHT, Maze.Direction.DOWN]
-        else:
-            directions = [Maze.Direction.LEFT, Maze.Direction.DOWN, Maze.Direction.RIGHT, Maze.Direction.UP]
-
-        # Heads of the passages, with the directions: (x, y, direction_index).
-        front_cells = list()
-
-        # Find the directions of the initial front cells.
+        # Corners of the exits, clockwise from the top left one. A counterclockwise spiral is computed mirrored.
+        corner_positions = [(0, 0), (width - 1, 0), (width - 1, height - 1), (0, height - 1)]
+        if not is_clockwise:
+            corner_positions = [(width - 1 - x, y) for x, y in corner_positions]
+        corners = set()
         for exit_x, exit_y in exits:
-            if exit_x is 0 and exit_y is 0:
-                if is_clockwise:
-                    front_cells.append((exit_x, exit_y, 2))
-                else:
-                    front_cells.append((exit_x, exit_y, 1))
-            elif exit_x is 0 and exit_y is height - 1:
-                if is_clockwise:
-                    front_cells.append((exit_x, exit_y, 1))
-                else:
-                    front_cells.append((exit_x, exit_y, 2))
-            elif exit_x is width - 1 and exit_y is height - 1:
-                if is_clockwise:
-                    front_cells.append((exit_x, exit_y, 0))
-                else:
-                    front_cells.append((exit_x, exit_y, 3))
-            elif exit_x is width - 1 and exit_y is 0:
-                if is_clockwise:
-                    front_cells.append((exit_x, exit_y, 3))
-                else:
-                    front_cells.append((exit_x, exit_y, 0))
-            else:
+            if (exit_x, exit_y) not in corner_positions:
                 raise RuntimeError('Invalid exit position (must be a corner): ({}, {})'.format(exit_x, exit_y))
-            maze.cell(exit_x, exit_y).set_meta(True)
-
-        while front_cells:
-            new_front_cells = list()
-            for x, y, direction_index in front_cells:
-                cell = maze.cell(x, y)
-                # If the passage can continue forward, just continue.
-                if cell.has_neighbor(directions[direction_index]) and \
-                        not cell.get_neighbor(directions[direction_index]).get_meta():
-                    cell.open(directions[direction_index])
-                    cell.get_neighbor(directions[direction_index]).set_meta(True)
-                    new_x = cell.get_neighbor(directions[direction_index]).x()
-                    new_y = cell.get_neighbor(directions[direction_index]).y()
-                    new_front_cells.append((new_x, new_y, direction_index))
-                # Otherwise, turn if there are still available direction.
-                # TODO: Don't do it more than once? Could fix some bad behavior (e.g. 13x14, ...).
-                elif True in [cell.has_neighbor(direction) and not cell.get_neighbor(direction).get_meta()
-                              for direction in directions]:
-                    new_front_cells.append((x, y, (direction_index + 1) % len(directions)))
-                # Otherwise, join other passages excepted if there is only one passage.
-                elif len(exits) > 1:
-                    cell.open(directions[direction_index])
-            front_cells = new_front_cells
-
-        return maze
+            corners.add(corner_positions.index((exit_x, exit_y)))
+        if not corners:
+            raise RuntimeError('{} needs at least one exit'.format(Spiral.__name__))
+
+        return Spiral._Generation(Maze(width, height, True, False), sorted(corners), is_clockwise)
+
+
+# Algorithms by name, e.g. for selecting them from a command line or a request.
+ALGORITHMS = {algorithm.__name__: algorithm for algorithm in (BinaryTree, Braid, Frontier, GrowingTree, HuntAndKill,
+                                                              Kruskal, Labyrinth, Labyrinth2, Lattice, Passage,
+                                                              RecursiveBackTracker, RecursiveBackTracker2, Room,
+                                                              Sidewinder, Spiral)}  # type: Dict[str, type]
+
+
+def resolve_parameters(parameters):
+    # type: (Any) -> Any
+
+    """
+    Replace the names of algorithms in parameters given as plain data (e.g. JSON) by the algorithms themselves, e.g. the
+    first algorithm of Braid.
+    """
+
+    if not parameters:
+        return parameters
+
+    return [ALGORITHMS.get(parameter, parameter) if isinstance(parameter, str) else parameter for parameter in parameters]
+
+
+def generate_bytes(algorithm, width, height, parameters, seed):
+    # type: (Union[str, type], int, int, Any, Union[int, None]) -> bytes
+
+    """
+    Generate one maze with an algorithm (a class or its name) and parameters given as plain data, and return it in its
+    binary format. This runs in the worker processes of the layouts and of the service.
+    """
+
+    if isinstance(algorithm, str):
+        algorithm = ALGORITHMS[algorithm]
+    generation = algorithm.start(width, height, resolve_parameters(parameters), RandomSource(seed))
+
+    return generation.finish().export_to_bytes()
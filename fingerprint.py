@@ -0,0 +1,156 @@
+"""
+Fingerprints of mazes, for dropping duplicates from large batches.
+
+A fingerprint is a 64-bit hash of the masks of a maze which is the same for the 8 rotations and reflections of the maze:
+it is the smallest of the hashes of the 8 transformed mazes. Each hash is a sum over the cells of a mix of the position
+and the mask of the cell in the transformed maze, so the rows can be added in any order, as soon as they are produced.
+"""
+
+from maze import DOWN, LEFT, RIGHT, UP, Maze
+
+try:
+    from typing import Any, Set, Tuple
+except ImportError:
+    Any, Set, Tuple = None, None, None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _transform_mask(mask, mirror_x, mirror_y, transpose):
+    # type: (int, bool, bool, bool) -> int
+
+    """
+    Return the mask of a cell in a transformed maze: the bits of the directions are swapped by the mirrors, then by the
+    transposition.
+    """
+
+    for is_swapped, first, second in ((mirror_x, LEFT, RIGHT), (mirror_y, UP, DOWN), (transpose, LEFT, UP),
+                                      (transpose, RIGHT, DOWN)):
+        if is_swapped and (mask >> first & 1) != (mask >> second & 1):
+            mask ^= 1 << first | 1 << second
+
+    return mask
+
+
+# The 8 symmetries: (mirror in x, mirror in y, transposition), the mirrors being applied first.
+SYMMETRIES = tuple((mirror_x, mirror_y, transpose) for transpose in (False, True) for mirror_y in (False, True)
+                   for mirror_x in (False, True))  # type: Tuple[Tuple[bool, bool, bool], ...]
+# Masks of the cells in the transformed mazes, by symmetry and mask.
+SYMMETRY_TABLES = tuple(bytes(_transform_mask(mask, *symmetry) for mask in range(256))
+                        for symmetry in SYMMETRIES)  # type: Tuple[bytes, ...]
+
+
+def _mix(values):
+    # type: (Any) -> Any
+
+    """
+    Mix an array of uint64 (the finalizer of SplitMix64).
+    """
+
+    values = (values ^ (values >> numpy.uint64(30))) * numpy.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> numpy.uint64(27))) * numpy.uint64(0x94D049BB133111EB)
+    return values ^ (values >> numpy.uint64(31))
+
+
+class Fingerprint(object):
+    """
+    Fingerprint of a maze in progress. Whole rows are added with :meth:`add_rows`, in any order, and :meth:`digest`
+    returns the fingerprint once all of them are there.
+    """
+
+    def __init__(self, width, height):
+        # type: (int, int) -> None
+
+        if numpy is None:
+            raise RuntimeError('NumPy is required for fingerprints')
+
+        self._width = width  # type: int
+        self._height = height  # type: int
+        self._sums = numpy.zeros(len(SYMMETRIES), dtype=numpy.uint64)  # type: Any
+        self._tables = numpy.frombuffer(b''.join(SYMMETRY_TABLES), dtype=numpy.uint8).reshape(len(SYMMETRIES), 256)
+        self._num_rows = 0  # type: int
+
+    def add_rows(self, y, masks):
+        # type: (int, Any) -> None
+
+        """
+        Add the rows from row 'y' on, given by their masks (a bytes-like object of whole rows).
+        """
+
+        width = self._width
+        masks = numpy.frombuffer(masks, dtype=numpy.uint8)
+        if len(masks) % width or y < 0 or y + len(masks) // width > self._height:
+            raise ValueError('Invalid rows: {} masks at row {} of a maze of {}x{}'.format(len(masks), y, width,
+                                                                                        self._height))
+        num_rows = len(masks) // width
+        xs = numpy.tile(numpy.arange(width, dtype=numpy.uint64), num_rows)
+        ys = numpy.repeat(numpy.arange(y, y + num_rows, dtype=numpy.uint64), width)
+        # The sums wrap around: they are added as arrays, since NumPy warns about the overflows of scalars.
+        sums = numpy.zeros(len(SYMMETRIES), dtype=numpy.uint64)
+        for symmetry, (mirror_x, mirror_y, transpose) in enumerate(SYMMETRIES):
+            new_xs = numpy.uint64(width - 1) - xs if mirror_x else xs
+            new_ys = numpy.uint64(self._height - 1) - ys if mirror_y else ys
+            if transpose:
+                positions = new_xs * numpy.uint64(self._height) + new_ys
+            else:
+                positions = new_ys * numpy.uint64(width) + new_xs
+            keys = positions << numpy.uint64(8) | self._tables[symmetry][masks].astype(numpy.uint64)
+            sums[symmetry] = _mix(keys).sum(dtype=numpy.uint64)
+        self._sums += sums
+        self._num_rows += num_rows
+
+    def digest(self):
+        # type: () -> int
+
+        if self._num_rows != self._height:
+            raise RuntimeError('{} rows of {} were added'.format(self._num_rows, self._height))
+
+        sizes = numpy.array([(self._height << 32 | self._width) if transpose else (self._width << 32 | self._height)
+                             for _, _, transpose in SYMMETRIES], dtype=numpy.uint64)
+        return int(_mix(self._sums ^ _mix(sizes)).min())
+
+
+def fingerprint(maze):
+    # type: (Maze) -> int
+
+    result = Fingerprint(maze.width(), maze.height())
+    result.add_rows(0, maze.export_to_masks())
+    return result.digest()
+
+
+class DuplicateFilter(object):
+    """
+    Filter of the duplicates of a batch: the fingerprints seen so far are kept in a set, so each maze costs O(1).
+    """
+
+    def __init__(self):
+        # type: () -> None
+
+        self._seen = set()  # type: Set[int]
+        self._num_duplicates = 0  # type: int
+
+    def __len__(self):
+        # type: () -> int
+
+        return len(self._seen)
+
+    def add(self, digest):
+        # type: (int) -> bool
+
+        """
+        Record a fingerprint, and return whether it is new.
+        """
+
+        if digest in self._seen:
+            self._num_duplicates += 1
+            return False
+        self._seen.add(digest)
+        return True
+
+    def num_duplicates(self):
+        # type: () -> int
+
+        return self._num_duplicates
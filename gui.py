@@ -1,6 +1,8 @@
 import enum
+import json
 import pyglet
 import random
+import time
 
 from maze import Maze
 
@@ -13,6 +15,9 @@ except ImportError:
 class Renderer(object):
     """
     Render a maze so that one can solve it!
+
+    The renderer times its phases and counts what it draws (see :meth:`stats`): the statistics can be shown in an
+    overlay, exported as JSON, or collected offscreen for a number of frames by :meth:`benchmark`.
     """
 
     class ColorTransition(enum.Enum):
@@ -26,10 +31,30 @@ class Renderer(object):
         HUE_5 = 4,
         RANDOM = 5
 
-    def __init__(self, maze, cells_size, num_initial_cells, color_walls, color_transition):
-        # type: (Maze, int, int, bool, Renderer.ColorTransition) -> None
+    def __init__(self, maze, cells_size, num_initial_cells, color_walls, color_transition, overlay=False,
+                 visible=True):
+        # type: (Maze, int, int, bool, Renderer.ColorTransition, bool, bool) -> None
 
-        self._window = pyglet.window.Window(fullscreen=True)  # type: pyglet.window.Window
+        start = time.perf_counter()
+        self._stats = {
+            'grid_time': 0.0,  # Export of the maze to the grid.
+            'walls_time': 0.0,  # Building of the set of walls.
+            'init_time': 0.0,
+            'flood_layers': 0,
+            'flood_time': 0.0,
+            'flood_max_layer_time': 0.0,
+            'quads': 0,
+            'frames': 0,
+            'draw_time': 0.0,
+            'draw_max_frame_time': 0.0,
+        }  # type: Dict[str, Any]
+        if visible:
+            self._window = pyglet.window.Window(fullscreen=True)  # type: pyglet.window.Window
+        else:
+            # Offscreen, e.g. for benchmarks: a hidden window of the size of the maze.
+            self._window = pyglet.window.Window((maze.width() * 2 + 1) * cells_size,
+                                                (maze.height() * 2 + 1) * cells_size, visible=False)
+        self._overlay = pyglet.text.Label('', x=10, y=10, color=(255, 255, 255, 255)) if overlay else None
         self._cells_size = cells_size  # type: int
         self._num_initial_cells = num_initial_cells  # type: int
         self._color_transition = color_transition  # type: Renderer.ColorTransition
@@ -48,14 +73,18 @@ class Renderer(object):
         else:
             walls = 1
             spaces = 0
+        phase_start = time.perf_counter()
         self._maze = maze.export_to_full_grid(spaces, walls)  # type: List[List[int]]
+        self._stats['grid_time'] = time.perf_counter() - phase_start
 
         # Get the list of all the walls.
+        phase_start = time.perf_counter()
         self._walls = set()  # type: Set[Tuple[int, int]]
         for y in range(self._height):
             for x in range(self._width):
                 if self._maze[x][y] is 0:
                     self._walls.add((x, y))
+        self._stats['walls_time'] = time.perf_counter() - phase_start
 
         # Pick random cells.
         self._frontier = set()  # type: Set[Tuple[int, int]]
@@ -67,6 +96,32 @@ class Renderer(object):
         random.shuffle(color)
         self._color = tuple(color)  # type: Tuple[int, int, int]
 
+        self._stats['init_time'] = time.perf_counter() - start
+
+    def benchmark(self, num_frames):
+        # type: (int) -> Dict[str, Any]
+
+        """
+        Flood the maze, draw 'num_frames' frames without going through the event loop, and return the statistics. Each
+        frame is waited for, so that the times include the rendering.
+        """
+
+        while self._flood(0):
+            pass
+        self._window.switch_to()
+        for _ in range(num_frames):
+            self._window.dispatch_events()
+            self._draw(True)
+            self._window.flip()
+
+        return self.stats()
+
+    def export_stats(self, path):
+        # type: (str) -> None
+
+        with open(path, 'w') as file:
+            json.dump(self.stats(), file, indent=2)
+
     def run(self):
         # type: () -> None
 
@@ -74,9 +129,7 @@ class Renderer(object):
         def on_draw():
             # type: () -> None
 
-            # TODO: Clear to white or black.
-            self._window.clear()
-            self._batch.draw()
+            self._draw()
 
         @self._window.event
         def on_key_press(symbol, _):
@@ -84,12 +137,25 @@ class Renderer(object):
 
             if symbol == pyglet.window.key.ESCAPE or symbol == pyglet.window.key.Q:
                 self._window.close()
+            elif symbol == pyglet.window.key.S and self._overlay is None:
+                self._overlay = pyglet.text.Label('', x=10, y=10, color=(255, 255, 255, 255))
+            elif symbol == pyglet.window.key.S:
+                self._overlay = None
 
         #pyglet.clock.schedule_interval(self._flood, 1 / 60)
         while self._flood(0):
             pass
         pyglet.app.run()
 
+    def stats(self):
+        # type: () -> Dict[str, Any]
+
+        stats = dict(self._stats)
+        stats['flood_mean_layer_time'] = stats['flood_time'] / stats['flood_layers'] if stats['flood_layers'] else 0.0
+        stats['draw_mean_frame_time'] = stats['draw_time'] / stats['frames'] if stats['frames'] else 0.0
+        stats['fps'] = stats['frames'] / stats['draw_time'] if stats['draw_time'] else 0.0
+        return stats
+
     def _add_cell(self, x, y):
         # type: (int, int) -> None
 
@@ -102,10 +168,35 @@ class Renderer(object):
         vertices = tuple(map(sum, zip(vertices, origin)))
 
         self._batch.add(4, pyglet.gl.GL_QUADS, None, ('v2i', vertices), ('c3B', self._color * 4))
+        self._stats['quads'] += 1
+
+    def _draw(self, wait=False):
+        # type: (bool) -> None
+
+        """
+        Draw a frame. With 'wait', the GPU is waited for, so that the frame time includes the rendering: that stalls the
+        pipeline, so only benchmarks do it.
+        """
+
+        start = time.perf_counter()
+        # TODO: Clear to white or black.
+        self._window.clear()
+        self._batch.draw()
+        if self._overlay is not None:
+            self._overlay.text = ('{quads} quads, {flood_layers} layers in {flood_time:.3f} s, init {init_time:.3f} s, '
+                                  '{draw_mean_frame_time:.4f} s per frame ({fps:.1f} FPS)'.format(**self.stats()))
+            self._overlay.draw()
+        if wait:
+            pyglet.gl.glFinish()
+        frame_time = time.perf_counter() - start
+        self._stats['frames'] += 1
+        self._stats['draw_time'] += frame_time
+        self._stats['draw_max_frame_time'] = max(self._stats['draw_max_frame_time'], frame_time)
 
     def _flood(self, _):
         # type: (float) -> None
 
+        start = time.perf_counter()
         if self._frontier:
             next_cells = set()
             for x, y in self._frontier:
@@ -122,6 +213,10 @@ class Renderer(object):
                     next_cells.add((x, y + 1))
             self._frontier = next_cells - self._frontier  # Do not add the cells that have been already dealt with.
             self._next_color()
+            layer_time = time.perf_counter() - start
+            self._stats['flood_layers'] += 1
+            self._stats['flood_time'] += layer_time
+            self._stats['flood_max_layer_time'] = max(self._stats['flood_max_layer_time'], layer_time)
         else:
             if self._walls:  # If there are still cells left (isolated areas), start a new frontier.
                 while len(self._frontier) < min(self._num_initial_cells, len(self._walls)):
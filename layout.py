@@ -0,0 +1,165 @@
+"""
+Declarative composition of mazes.
+
+A :class:`Layout` lists rectangular regions of a maze, each generated by its own algorithm, the openings which connect
+them to the rest of the maze, and the algorithm which fills the cells around them. The layout is checked as a whole
+before any work starts, the regions are generated independently (over several worker processes if asked) and copied
+into the maze by rows (see :meth:`maze.Maze.place`), then the fill carves the rest.
+"""
+
+import concurrent.futures
+
+from algorithms import ALGORITHMS, Algorithm, Frontier, generate_bytes
+from maze import DIRECTIONS, DX, DY, Maze
+from randomness import RandomSource
+
+try:
+    from typing import Any, List, Tuple, Type, Union
+except ImportError:
+    Any, List, Tuple, Type, Union = None, None, None, None, None
+
+
+class Region(object):
+    """
+    A rectangle of a layout, generated by an algorithm (a class or its name) with the given parameters, or given as an
+    already generated maze. The openings are links (x, y, direction, is_open) set after the region is placed, with
+    coordinates relative to the region and directions given as :class:`maze.Maze.Direction` or as codes: usually the
+    links across the border of the region, which is otherwise closed.
+    """
+
+    def __init__(self, x, y, width, height, algorithm=None, parameters=None, openings=None, seed=None, maze=None):
+        # type: (int, int, int, int, Union[str, Type[Algorithm], None], Any, List[Tuple[int, int, Any, bool]], Union[int, None], Union[Maze, None]) -> None
+
+        if (algorithm is None) == (maze is None):
+            raise ValueError('A region is given either by an algorithm or by a maze')
+        if maze is not None and (maze.width() != width or maze.height() != height):
+            raise ValueError('The maze of a region of {}x{} is {}x{}'.format(width, height, maze.width(),
+                                                                             maze.height()))
+        if isinstance(algorithm, str) and algorithm not in ALGORITHMS:
+            raise ValueError('Unknown algorithm {}'.format(algorithm))
+
+        self.x = x  # type: int
+        self.y = y  # type: int
+        self.width = width  # type: int
+        self.height = height  # type: int
+        self.algorithm = algorithm  # type: Union[str, Type[Algorithm], None]
+        self.parameters = parameters  # type: Any
+        self.openings = [(open_x, open_y, direction if isinstance(direction, int) else direction.code(), is_open)
+                         for open_x, open_y, direction, is_open in openings or ()]  # type: List[Tuple[int, int, int, bool]]
+        self.seed = seed  # type: Union[int, None]
+        self.maze = maze  # type: Union[Maze, None]
+
+    def __str__(self):
+        # type: () -> str
+
+        return 'region of {}x{} at ({}, {})'.format(self.width, self.height, self.x, self.y)
+
+    def contains(self, x, y):
+        # type: (int, int) -> bool
+
+        return self.x <= x < self.x + self.width and self.y <= y < self.y + self.height
+
+    def overlaps(self, other):
+        # type: (Region) -> bool
+
+        return (self.x < other.x + other.width and other.x < self.x + self.width and
+                self.y < other.y + other.height and other.y < self.y + self.height)
+
+
+class Layout(object):
+    """
+    A maze composed of regions. The fill algorithm runs last, on the whole maze, with the parameters (maze, start): it
+    takes a maze with sub mazes, as :class:`algorithms.Frontier` does, and starts out of the regions.
+
+    If a seed is given, the regions without a seed of their own and the fill get seeds drawn from it, so that the whole
+    composition is reproducible.
+    """
+
+    def __init__(self, width, height, regions=None, fill=Frontier, fill_start=(0, 0), seed=None):
+        # type: (int, int, List[Region], Union[str, Type[Algorithm], None], Tuple[int, int], Union[int, None]) -> None
+
+        self.width = width  # type: int
+        self.height = height  # type: int
+        self.regions = list(regions or ())  # type: List[Region]
+        self.fill = ALGORITHMS[fill] if isinstance(fill, str) else fill  # type: Union[Type[Algorithm], None]
+        self.fill_start = fill_start  # type: Tuple[int, int]
+        self.seed = seed  # type: Union[int, None]
+
+    def add(self, region):
+        # type: (Region) -> Region
+
+        self.regions.append(region)
+        return region
+
+    def build(self, jobs=1):
+        # type: (int) -> Maze
+
+        """
+        Check the layout, generate the regions over 'jobs' worker processes, place them and run the fill.
+        """
+
+        self.validate()
+
+        rng = RandomSource(self.seed) if self.seed is not None else None
+        seeds = [region.seed if region.seed is not None or rng is None else rng.randrange(1 << 32)
+                 for region in self.regions]
+        fill_seed = rng.randrange(1 << 32) if rng is not None else None
+
+        tasks = [(region.algorithm, region.width, region.height, region.parameters, seed)
+                 for region, seed in zip(self.regions, seeds) if region.maze is None]
+        if jobs > 1 and len(tasks) > 1:
+            with concurrent.futures.ProcessPoolExecutor(min(jobs, len(tasks))) as executor:
+                results = list(executor.map(generate_bytes, *zip(*tasks)))
+        else:
+            results = [generate_bytes(*task) for task in tasks]
+        built = iter(results)
+
+        maze = Maze(self.width, self.height, True)
+        for region in self.regions:
+            sub_maze = region.maze if region.maze is not None else Maze.from_bytes(next(built))
+            maze.place(sub_maze, region.x, region.y)
+            for x, y, direction, is_open in region.openings:
+                maze.set_link((region.y + y) * self.width + region.x + x, direction, is_open)
+
+        if self.fill is not None:
+            maze = self.fill.run(self.width, self.height, (maze, self.fill_start), RandomSource(fill_seed))
+
+        return maze
+
+    def validate(self):
+        # type: () -> None
+
+        """
+        Raise a ValueError if a region is out of the maze or overlaps another one, if an opening leads out of the maze,
+        or if the fill does not take a maze (see :attr:`algorithms.Algorithm.TAKES_MAZE`) or starts in a region.
+        """
+
+        if self.width <= 0 or self.height <= 0:
+            raise ValueError('Invalid size {}x{}'.format(self.width, self.height))
+
+        for i, region in enumerate(self.regions):
+            if (region.width <= 0 or region.height <= 0 or region.x < 0 or region.y < 0 or
+                    region.x + region.width > self.width or region.y + region.height > self.height):
+                raise ValueError('The {} is out of the maze of {}x{}'.format(region, self.width, self.height))
+            for other in self.regions[:i]:
+                if region.overlaps(other):
+                    raise ValueError('The {} overlaps the {}'.format(region, other))
+            for x, y, direction, _ in region.openings:
+                if direction not in DIRECTIONS or not (0 <= x < region.width and 0 <= y < region.height):
+                    raise ValueError('Invalid opening ({}, {}, {}) of the {}'.format(x, y, direction, region))
+                neighbor_x = region.x + x + DX[direction]
+                neighbor_y = region.y + y + DY[direction]
+                if not (0 <= neighbor_x < self.width and 0 <= neighbor_y < self.height):
+                    raise ValueError('The opening ({}, {}, {}) of the {} leads out of the maze'.format(x, y, direction,
+                                                                                                        region))
+
+        if self.fill is not None:
+            if not self.fill.TAKES_MAZE:
+                raise ValueError('The fill {} does not take a maze: it would discard the regions'.format(
+                    self.fill.__name__))
+            start_x, start_y = self.fill_start
+            if not (0 <= start_x < self.width and 0 <= start_y < self.height):
+                raise ValueError('The fill starts out of the maze at ({}, {})'.format(start_x, start_y))
+            for region in self.regions:
+                if region.contains(start_x, start_y):
+                    raise ValueError('The fill starts in the {}'.format(region))
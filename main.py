@@ -1,62 +1,272 @@
-from algorithms import Braid, Frontier, HuntAndKill, Labyrinth, Labyrinth2, Passage, RecursiveBackTracker, RecursiveBackTracker2, Room, Spiral
-from gui import Renderer
-from maze import Maze
-
-cells_size = 4
-width = ((1920 // cells_size) - 1) // 2
-height = ((1080 // cells_size) - 1) // 2
-choice = 10
-
-if choice is 1:
-    maze = RecursiveBackTracker.run(width, height)
-elif choice is 2:
-    maze = HuntAndKill.run(width, height)
-elif choice is 3:
-    maze = Labyrinth.run(width, height)
-elif choice is 4:
-    maze = Room.run(width, height)
-elif choice is 5:
-    maze = Passage.run(width, height, [None, (0, 0), (width - 1, height - 1)])
-elif choice is 6:
-    maze = Braid.run(width, height, [None, (0, 0), RecursiveBackTracker, 0.1])
-elif choice is 7:
-    maze = Spiral.run(width, height, [None, [(0, 0), (0, height - 1), (width - 1, height - 1), (width - 1, 0)], True])
-elif choice is 8:
-    maze = Frontier.run(width, height)
-elif choice is 9:
-    for i in range(1000):
-        maze, c = Labyrinth2.run(50, 50)
-        print('{}/1000'.format(i + 1))
-        if not c:
-            break
-    #maze = Labyrinth2.run(50, 50)
-elif choice is 10:
-    maze = RecursiveBackTracker2.run(49, 49)
-elif choice is 11:
-    # 'J'.
-    sub_maze_1 = RecursiveBackTracker.run(30, 10), [(0, 0, Maze.Direction.LEFT, True)], (30, 30)
-    sub_maze_2 = RecursiveBackTracker.run(10, 30), [(0, 0, Maze.Direction.UP, True)], (40, 40)
-    sub_maze_3 = RecursiveBackTracker.run(10, 10), [(9, 9, Maze.Direction.RIGHT, True)], (30, 60)
-    # 'i'.
-    sub_maze_4 = RecursiveBackTracker.run(10, 10), list(), (70, 30)
-    sub_maze_5 = RecursiveBackTracker.run(10, 25), list(), (70, 45)
-    # 'M'.
-    sub_maze_6 = RecursiveBackTracker.run(30, 10), [(0, 0, Maze.Direction.LEFT, True)], (90, 30)
-    sub_maze_7 = RecursiveBackTracker.run(10, 30), [(0, 0, Maze.Direction.UP, True)], (90, 40)
-    sub_maze_8 = RecursiveBackTracker.run(10, 30), [(0, 0, Maze.Direction.UP, True)], (110, 40)
-    sub_maze_9 = RecursiveBackTracker.run(4, 10), [(0, 0, Maze.Direction.UP, True)], (103, 40)
-    # Link 'J' and 'i'.
-    sub_maze_10 = Passage.run(10, 10, (None, (0, 0), (9, 0))), [(0, 0, Maze.Direction.LEFT, True), (9, 0, Maze.Direction.RIGHT, True)], (60, 30)
-    # Link the dot of the 'i' and the base of the 'i'.
-    sub_maze_11 = Passage.run(10, 5, (None, (9, 0), (9, 4))), [(9, 0, Maze.Direction.UP, True), (9, 4, Maze.Direction.DOWN, True)], (70, 40)
-    # Link 'i' and 'M'.
-    sub_maze_12 = Passage.run(10, 10, (None, (0, 0), (9, 0))), [(0, 0, Maze.Direction.LEFT, True), (9, 0, Maze.Direction.RIGHT, True)], (80, 30)
-    # Make a spiral.
+"""
+Generate mazes in bulk.
+
+Mazes of the given algorithm and size are generated for a range of seeds, over several worker processes if asked, and
+written to a directory in one of the output formats. A summary of the throughput is printed at the end.
+
+Usage::
+
+    python main.py RecursiveBackTracker --size 200x200 --count 1000 --seed 0 --jobs 8 --format png --output mazes
+    python main.py Braid --parameters '[null, null, "Frontier", 0.5]' --count 10 --profile braid.prof
+    python main.py Labyrinth2 --size 2000x2000 --checkpoints checkpoints --checkpoint-interval 300
+    python main.py Labyrinth2 --size 50x50 --count 1000 --dedupe --format png --output labyrinths
+    python main.py Frontier --size 239x134 --show --overlay
+    python main.py Frontier --size 239x134 --render-benchmark 600 --render-stats render.json
+    python main.py --demo
+"""
+
+import argparse
+import concurrent.futures
+import cProfile
+import hashlib
+import json
+import os
+import pstats
+import sys
+import tempfile
+import time
+
+from algorithms import ALGORITHMS, Frontier, Generation, Passage, RecursiveBackTracker, Spiral, resolve_parameters
+from fingerprint import DuplicateFilter, fingerprint
+from layout import Layout, Region
+from maze import DOWN, LEFT, RIGHT, UP, Maze
+from randomness import RandomSource
+
+try:
+    from typing import Any, Callable, Dict, List, Tuple, Union
+except ImportError:
+    Any, Callable, Dict, List, Tuple, Union = None, None, None, None, None, None
+
+
+# Output formats: extension of the files and export function.
+FORMATS = {
+    'binary': ('maze', Maze.export_to_bytes),
+    'bits': ('json', lambda maze: json.dumps(maze.export_to_bits()).encode('utf-8')),
+    'png': ('png', Maze.export_to_png),
+}  # type: Dict[str, Tuple[str, Callable[[Maze], bytes]]]
+
+
+def generate(algorithm_name, width, height, parameters, seed, checkpoint=None, interval=60.0):
+    # type: (str, int, int, Any, Union[int, None], Union[str, None], float) -> Maze
+
+    """
+    Generate one maze. If a checkpoint path is given, the generation is saved there periodically, and resumed from
+    there if a previous run was interrupted.
+    """
+
+    if checkpoint is not None and os.path.exists(checkpoint):
+        generation = Generation.load(checkpoint)
+    else:
+        generation = ALGORITHMS[algorithm_name].start(width, height, resolve_parameters(parameters), RandomSource(seed))
+
+    return generation.finish(checkpoint, interval)
+
+
+def run(job):
+    # type: (Tuple[Any, ...]) -> Dict[str, Any]
+
+    """
+    Generate one maze, write it if an output directory is given, and return the timings of the run, and the fingerprint
+    of the maze if asked. This runs in the worker processes.
+    """
+
+    (algorithm_name, width, height, parameters, seed, output_format, output, profile, checkpoints, interval,
+     dedupe) = job
+    name = '{}_{}x{}_{}'.format(algorithm_name, width, height, seed)
+    checkpoint = None
+    if checkpoints is not None:
+        # The parameters are part of the name, so that a checkpoint is only resumed by the same job.
+        parameters_digest = hashlib.sha1(json.dumps(parameters, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        checkpoint = os.path.join(checkpoints, '{}_{}.checkpoint'.format(name, parameters_digest))
+
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+    start = time.perf_counter()
+    maze = generate(algorithm_name, width, height, parameters, seed, checkpoint, interval)
+    generation_time = time.perf_counter() - start
+    if profiler is not None:
+        profiler.disable()
+
+    num_bytes = 0
+    path = None
+    if output is not None:
+        extension, export = FORMATS[output_format]
+        data = export(maze)
+        path = os.path.join(output, '{}.{}'.format(name, extension))
+        with open(path, 'wb') as file:
+            file.write(data)
+        num_bytes = len(data)
+
+    profile_path = None
+    if profiler is not None:
+        file_descriptor, profile_path = tempfile.mkstemp(suffix='.prof')
+        os.close(file_descriptor)
+        profiler.dump_stats(profile_path)
+
+    return {'seed': seed, 'generation_time': generation_time, 'total_time': time.perf_counter() - start,
+            'bytes': num_bytes, 'profile': profile_path, 'path': path,
+            'fingerprint': fingerprint(maze) if dedupe else None}
+
+
+def letters(width, height, jobs=1):
+    # type: (int, int, int) -> Maze
+
+    """
+    Compose 'JiM' and a spiral from several regions, and fill the rest of the maze. The result is a perfect maze.
+    """
+
     spiral_size = 15
-    sub_maze_13 = Spiral.run(spiral_size, spiral_size, [None, [(0, 0), (0, spiral_size - 1), (spiral_size - 1, spiral_size - 1), (spiral_size - 1, 0)], True]), [(0, 0, Maze.Direction.LEFT, True), (0, spiral_size - 1, Maze.Direction.DOWN, True), (spiral_size - 1, spiral_size - 1, Maze.Direction.RIGHT, True), (spiral_size - 1, 0, Maze.Direction.UP, True)], (140, 50)
-    maze = Maze(width, height, True, False, [sub_maze_1, sub_maze_2, sub_maze_3, sub_maze_4, sub_maze_5, sub_maze_6, sub_maze_7, sub_maze_8, sub_maze_9, sub_maze_10, sub_maze_11, sub_maze_12, sub_maze_13])
-    maze = Frontier.run(width, height, (maze, (0, 0)))
-else:
-    raise RuntimeError('You stupid!')
+    corners = [(0, 0), (0, spiral_size - 1), (spiral_size - 1, spiral_size - 1), (spiral_size - 1, 0)]
+    layout = Layout(width, height, [
+        # 'J'.
+        Region(30, 30, 30, 10, RecursiveBackTracker, openings=[(0, 0, LEFT, True)]),
+        Region(40, 40, 10, 30, RecursiveBackTracker, openings=[(0, 0, UP, True)]),
+        Region(30, 60, 10, 10, RecursiveBackTracker, openings=[(9, 9, RIGHT, True)]),
+        # 'i'.
+        Region(70, 30, 10, 10, RecursiveBackTracker),
+        Region(70, 45, 10, 25, RecursiveBackTracker),
+        # 'M'.
+        Region(90, 30, 30, 10, RecursiveBackTracker, openings=[(0, 0, LEFT, True)]),
+        Region(90, 40, 10, 30, RecursiveBackTracker, openings=[(0, 0, UP, True)]),
+        Region(110, 40, 10, 30, RecursiveBackTracker, openings=[(0, 0, UP, True)]),
+        Region(103, 40, 4, 10, RecursiveBackTracker, openings=[(0, 0, UP, True)]),
+        # Link 'J' and 'i'.
+        Region(60, 30, 10, 10, Passage, (None, (0, 0), (9, 0)), [(0, 0, LEFT, True), (9, 0, RIGHT, True)]),
+        # Link the dot of the 'i' and the base of the 'i'.
+        Region(70, 40, 10, 5, Passage, (None, (9, 0), (9, 4)), [(9, 0, UP, True), (9, 4, DOWN, True)]),
+        # Link 'i' and 'M'.
+        Region(80, 30, 10, 10, Passage, (None, (0, 0), (9, 0)), [(0, 0, LEFT, True), (9, 0, RIGHT, True)]),
+        # Make a spiral. It is entered by one corner only: the fill already links the cells around it, so more openings
+        # would make loops.
+        Region(140, 50, spiral_size, spiral_size, Spiral, [None, corners, True], [(0, 0, LEFT, True)]),
+    ], Frontier, (0, 0))
+
+    return layout.build(jobs)
+
+
+def show(maze, cells_size, overlay=False, stats=None):
+    # type: (Maze, int, bool, Union[str, None]) -> None
+
+    from gui import Renderer  # The GUI is only needed here: batches run without pyglet.
+
+    renderer = Renderer(maze, cells_size, 1, False, Renderer.ColorTransition.HUE, overlay)
+    renderer.run()
+    if stats is not None:
+        renderer.export_stats(stats)
+
+
+def render_benchmark(maze, cells_size, num_frames, stats=None):
+    # type: (Maze, int, int, Union[str, None]) -> None
+
+    """
+    Render a maze offscreen for a number of frames, and print the statistics of the renderer.
+    """
+
+    from gui import Renderer
+
+    renderer = Renderer(maze, cells_size, 1, False, Renderer.ColorTransition.HUE, visible=False)
+    print(json.dumps(renderer.benchmark(num_frames), indent=2))
+    if stats is not None:
+        renderer.export_stats(stats)
+
+
+def main():
+    # type: () -> None
+
+    parser = argparse.ArgumentParser(description='Generate mazes in bulk.')
+    parser.add_argument('algorithm', nargs='?', choices=sorted(ALGORITHMS))
+    parser.add_argument('--size', default='100x100', help='WIDTHxHEIGHT of the mazes')
+    parser.add_argument('--parameters', type=json.loads, help='parameters of the algorithm, as a JSON list in which '
+                                                              'algorithms are given by name')
+    parser.add_argument('--seed', type=int, default=0, help='first seed')
+    parser.add_argument('--count', type=int, default=1, help='number of mazes, with consecutive seeds')
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='binary', help='format of the written mazes')
+    parser.add_argument('--output', metavar='DIRECTORY', help='write the mazes there (default: do not write them)')
+    parser.add_argument('--checkpoints', metavar='DIRECTORY', help='save the generations in progress there, and resume '
+                                                                   'the ones found there')
+    parser.add_argument('--checkpoint-interval', type=float, default=60.0, help='seconds between two checkpoints')
+    parser.add_argument('--dedupe', action='store_true', help='drop the mazes which are duplicates of previous ones, up '
+                                                              'to rotations and reflections')
+    parser.add_argument('--profile', metavar='FILE', help='profile the generations and dump the cProfile stats there')
+    parser.add_argument('--quiet', action='store_true', help='only print the summary')
+    parser.add_argument('--show', action='store_true', help='show the first maze in the GUI')
+    parser.add_argument('--cells-size', type=int, default=4, help='size of the cells in the GUI, in pixels')
+    parser.add_argument('--demo', action='store_true', help='show a composition of sub mazes in the GUI')
+    parser.add_argument('--overlay', action='store_true', help='show the statistics of the renderer in the GUI (toggled '
+                                                               'with S)')
+    parser.add_argument('--render-stats', metavar='FILE', help='export the statistics of the renderer there, as JSON')
+    parser.add_argument('--render-benchmark', type=int, metavar='FRAMES', help='render the first maze offscreen for '
+                                                                               'that many frames and print the '
+                                                                               'statistics of the renderer')
+    arguments = parser.parse_args()
+
+    if arguments.demo:
+        show(letters(((1920 // arguments.cells_size) - 1) // 2, ((1080 // arguments.cells_size) - 1) // 2,
+                     arguments.jobs), arguments.cells_size, arguments.overlay, arguments.render_stats)
+        return
+    if arguments.algorithm is None:
+        parser.error('an algorithm is required')
+    width, height = (int(n) for n in arguments.size.split('x'))
+    for directory in (arguments.output, arguments.checkpoints):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    jobs = [(arguments.algorithm, width, height, arguments.parameters, seed, arguments.format, arguments.output,
+             arguments.profile is not None, arguments.checkpoints, arguments.checkpoint_interval, arguments.dedupe)
+            for seed in range(arguments.seed, arguments.seed + arguments.count)]
+    results = list()  # type: List[Dict[str, Any]]
+    duplicates = DuplicateFilter() if arguments.dedupe else None
+    start = time.perf_counter()
+    if arguments.jobs > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(arguments.jobs)
+        runs = executor.map(run, jobs, chunksize=max(1, len(jobs) // (arguments.jobs * 16)))
+    else:
+        executor = None
+        runs = map(run, jobs)
+    for result in runs:
+        # Dropped mazes are out of the summary, as their files.
+        if duplicates is not None and not duplicates.add(result['fingerprint']):
+            for path in (result['path'], result['profile']):
+                if path is not None:
+                    os.remove(path)
+            if not arguments.quiet:
+                print('seed {}: duplicate, dropped'.format(result['seed']))
+            continue
+        results.append(result)
+        if not arguments.quiet:
+            print('seed {seed}: {generation_time:.4f} s, {cells_per_second:.0f} cells/s, {bytes} bytes'.format(
+                cells_per_second=width * height / result['generation_time'] if result['generation_time'] else 0,
+                **result))
+    duration = time.perf_counter() - start
+    if executor is not None:
+        executor.shutdown()
+
+    generation_time = sum(result['generation_time'] for result in results)
+    print('{} mazes of {}x{} in {:.3f} s over {} job(s): {:.1f} mazes/s, {:.0f} cells/s, {:.2f} MB/s written, '
+          '{:.4f} s of generation per maze'.format(len(results), width, height, duration, arguments.jobs,
+                                                   len(results) / duration, len(results) * width * height / duration,
+                                                   sum(result['bytes'] for result in results) / duration / 1e6,
+                                                   generation_time / len(results) if results else 0))
+    if duplicates is not None:
+        print('{} duplicate(s) dropped, {} distinct maze(s)'.format(duplicates.num_duplicates(), len(duplicates)))
+
+    if arguments.profile is not None:
+        paths = [result['profile'] for result in results]
+        stats = pstats.Stats(*paths)
+        stats.dump_stats(arguments.profile)
+        for path in paths:
+            os.remove(path)
+        stats.sort_stats('cumulative').print_stats(20)
+
+    if arguments.render_benchmark is not None:
+        render_benchmark(generate(arguments.algorithm, width, height, arguments.parameters, arguments.seed),
+                         arguments.cells_size, arguments.render_benchmark, arguments.render_stats)
+    if arguments.show:
+        show(generate(arguments.algorithm, width, height, arguments.parameters, arguments.seed), arguments.cells_size,
+             arguments.overlay, arguments.render_stats)
+
 
-Renderer(maze, cells_size, 1, False, Renderer.ColorTransition.HUE).run()
+if __name__ == '__main__':
+    sys.exit(main())
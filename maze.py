@@ -1,118 +1,444 @@
+import array
 import enum
+import itertools
 import random
+import struct
+import zlib
 
 try:
-    from typing import Any, Callable, Dict, List, Set, Tuple
+    from typing import Any, Callable, Dict, Iterable, List, Set, Tuple, Union
 except ImportError:
-    Any, Callable, Dict, List, Set, Tuple = None, None, None, None, None, None
+    Any, Callable, Dict, Iterable, List, Set, Tuple, Union = None, None, None, None, None, None, None, None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Integer codes of the directions. The algorithms work with those on their hot paths instead of :class:`Maze.Direction`.
+# The code of a direction is also the position of its bit in the masks exported by :meth:`Maze.export_to_bits`.
+LEFT, UP, RIGHT, DOWN = range(4)
+DIRECTIONS = (LEFT, UP, RIGHT, DOWN)  # type: Tuple[int, ...]
+OPPOSITES = (RIGHT, DOWN, LEFT, UP)  # type: Tuple[int, ...]
+PERPENDICULARS = ((UP, DOWN), (LEFT, RIGHT), (UP, DOWN), (LEFT, RIGHT))  # type: Tuple[Tuple[int, int], ...]
+OTHERS = tuple(tuple(other for other in DIRECTIONS if other != code) for code in DIRECTIONS)  # type: Tuple[Tuple[int, ...], ...]
+DX = (-1, 0, 1, 0)  # type: Tuple[int, ...]
+DY = (0, -1, 0, 1)  # type: Tuple[int, ...]
+
+# Masks of the cells are stored by pages of PAGE_SIZE cells. See Maze.
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_MASK = PAGE_SIZE - 1
+# Page of zeros: masks with all the links closed, or bits of no element of a Bitset. Pages are copied on write, so the
+# untouched pages of all the mazes and bitsets are this one.
+ZERO_PAGE = bytes(PAGE_SIZE)
+# A page of a Bitset holds the bits of BITS_PAGE_SIZE elements.
+BITS_PAGE_SHIFT = PAGE_SHIFT + 3
+BITS_PAGE_SIZE = 1 << BITS_PAGE_SHIFT
+
+# Header of the binary format of the mazes (see Maze.export_to_bytes): magic, width, height.
+BYTES_HEADER = struct.Struct('<4sII')
+BYTES_MAGIC = b'MAZE'
+
+# Pixel values of the rows of the PNG export (see Maze.export_to_png), indexed by masks.
+PNG_WALL, PNG_SPACE = 0, 255
+PNG_RIGHT = bytes(PNG_SPACE if mask & (1 << RIGHT) else PNG_WALL for mask in range(256))
+PNG_DOWN = bytes(PNG_SPACE if mask & (1 << DOWN) else PNG_WALL for mask in range(256))
+
+# All the orderings of the four directions. A random ordering is 'PERMUTATIONS[random.randrange(NUM_PERMUTATIONS)]'.
+PERMUTATIONS = tuple(itertools.permutations(DIRECTIONS))  # type: Tuple[Tuple[int, ...], ...]
+NUM_PERMUTATIONS = len(PERMUTATIONS)  # type: int
+
+
+class Bitset(object):
+    """
+    Set of small non-negative integers (e.g. indices of cells) stored as bits, by pages. The pages without elements are
+    all :data:`ZERO_PAGE`, so a bitset only costs memory for the pages which hold elements, and allocating, copying and
+    clearing a bitset are a fraction of the cost of touching each element.
+    """
+
+    def __init__(self, size):
+        # type: (int) -> None
+
+        self._size = size  # type: int
+        self._pages = [ZERO_PAGE] * ((size + BITS_PAGE_SIZE - 1) >> BITS_PAGE_SHIFT)  # type: List[Union[bytes, bytearray]]
+
+    def __contains__(self, i):
+        # type: (int) -> bool
+
+        return self._pages[i >> BITS_PAGE_SHIFT][i >> 3 & PAGE_MASK] >> (i & 7) & 1 == 1
+
+    def __len__(self):
+        # type: () -> int
+
+        return sum(bin(int.from_bytes(page, 'little')).count('1') for page in self._pages if page is not ZERO_PAGE)
+
+    def __setstate__(self, state):
+        # type: (Dict[str, Any]) -> None
+
+        # Unpickled pages of zeros are copies: share ZERO_PAGE again.
+        self.__dict__.update(state)
+        self._pages = [ZERO_PAGE if isinstance(page, bytes) else page for page in self._pages]
+
+    def add(self, i):
+        # type: (int) -> None
+
+        page = self._pages[i >> BITS_PAGE_SHIFT]
+        if page is ZERO_PAGE:
+            page = self._pages[i >> BITS_PAGE_SHIFT] = bytearray(PAGE_SIZE)
+        page[i >> 3 & PAGE_MASK] |= 1 << (i & 7)
+
+    def add_range(self, start, stop):
+        # type: (int, int) -> None
+
+        """
+        Add the integers of [start, stop), by whole bytes between the partial ones at the ends.
+        """
+
+        while start < stop:
+            page_index = start >> BITS_PAGE_SHIFT
+            page_start = page_index << BITS_PAGE_SHIFT
+            page_stop = min(stop, page_start + BITS_PAGE_SIZE)
+            page = self._pages[page_index]
+            if page is ZERO_PAGE:
+                page = self._pages[page_index] = bytearray(PAGE_SIZE)
+            i = start - page_start
+            j = page_stop - page_start
+            while i < j and i & 7:
+                page[i >> 3] |= 1 << (i & 7)
+                i += 1
+            num_bytes = (j - i) >> 3
+            page[i >> 3:(i >> 3) + num_bytes] = b'\xff' * num_bytes
+            i += num_bytes << 3
+            while i < j:
+                page[i >> 3] |= 1 << (i & 7)
+                i += 1
+            start = page_stop
+
+    def clear(self):
+        # type: () -> None
+
+        self._pages = [ZERO_PAGE] * len(self._pages)
+
+    def copy(self):
+        # type: () -> Bitset
+
+        bitset = Bitset.__new__(Bitset)
+        bitset._size = self._size
+        bitset._pages = [page if page is ZERO_PAGE else bytearray(page) for page in self._pages]
+        return bitset
+
+    def discard(self, i):
+        # type: (int) -> None
+
+        page = self._pages[i >> BITS_PAGE_SHIFT]
+        if page is not ZERO_PAGE:
+            page[i >> 3 & PAGE_MASK] &= ~(1 << (i & 7))
+
+    def lookup(self, indices):
+        # type: (Any) -> Any
+
+        """
+        Return a NumPy array of booleans: whether each integer of an array is in the set. The bits are gathered page by
+        page, so the cost depends on the number of integers, not on the size of the set.
+        """
+
+        if numpy is None:
+            raise RuntimeError('NumPy is required for looking up arrays')
+
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        flat_indices = indices.ravel()
+        result = numpy.zeros(len(flat_indices), dtype=numpy.bool_)
+        pages = flat_indices >> BITS_PAGE_SHIFT
+        order = numpy.argsort(pages, kind='stable')
+        pages = pages[order]
+        bounds = numpy.flatnonzero(numpy.concatenate(([len(pages) > 0], pages[1:] != pages[:-1]))).tolist()
+        for start, stop in zip(bounds, bounds[1:] + [len(flat_indices)]):
+            page = self._pages[int(pages[start])]
+            if page is ZERO_PAGE:
+                continue
+            positions = order[start:stop]
+            offsets = flat_indices[positions] & BITS_PAGE_SIZE - 1
+            result[positions] = numpy.frombuffer(page, dtype=numpy.uint8)[offsets >> 3] >> (offsets & 7) & 1
+
+        return result.reshape(indices.shape)
+
+    def size(self):
+        # type: () -> int
+
+        return self._size
+
+    def to_bytes(self):
+        # type: () -> bytes
+
+        """
+        Return the bits of the set: element i is bit i % 8 of byte i // 8 (e.g. for NumPy's unpackbits with the 'little'
+        bit order).
+        """
+
+        return b''.join(self._pages)[:(self._size + 7) >> 3]
 
 
-class Link(object):
+class DisjointSet(object):
     """
-    Link between two adjacent cells. A link is either a wall or a passage.
+    Union-find over the integers [0, size): the parents are stored in a flat array of ints and the ranks in a bytearray,
+    the paths are halved on finds and the sets are united by rank.
     """
 
-    def __init__(self, is_open):
-        # type: (bool) -> None
+    def __init__(self, size):
+        # type: (int) -> None
 
-        self._is_open = is_open
+        self._parents = array.array('i' if size < 1 << 31 else 'q', range(size))  # type: array.array
+        self._ranks = bytearray(size)  # type: bytearray
+        self._num_sets = size  # type: int
 
-    def open(self):
+    def find(self, i):
+        # type: (int) -> int
+
+        parents = self._parents
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+
+        return i
+
+    def num_sets(self):
+        # type: () -> int
+
+        return self._num_sets
+
+    def union(self, i, j):
+        # type: (int, int) -> int
+
+        """
+        Unite the sets of i and j, and return the root of the united set, or -1 if they were already in the same set.
+        """
+
+        i = self.find(i)
+        j = self.find(j)
+        if i == j:
+            return -1
+        if self._ranks[i] < self._ranks[j]:
+            i, j = j, i
+        elif self._ranks[i] == self._ranks[j]:
+            self._ranks[i] += 1
+        self._parents[j] = i
+        self._num_sets -= 1
+
+        return i
+
+
+class Journal(object):
+    """
+    Append-only record of the changes of the links of a maze. An entry is packed in one integer
+    '(index << 3) | (direction << 1) | is_open': the index of the cell, the code of the direction of the link and its new
+    state. Only actual changes are recorded.
+
+    The position in the journal (see :meth:`mark`) is a mark to which the maze can be reverted with :meth:`Maze.undo`.
+    Subscribers receive the entries appended since their last call when :meth:`publish` is called, so that they can
+    apply the changes incrementally.
+    """
+
+    def __init__(self):
         # type: () -> None
 
-        self._is_open = True
+        self._entries = array.array('q')  # type: array.array
+        self._subscribers = list()  # type: List[List[Any]]
+
+    def __getstate__(self):
+        # type: () -> Dict[str, Any]
+
+        # Subscribers are callbacks of the running process: they are not saved with the journal.
+        return {'_entries': self._entries, '_subscribers': list()}
+
+    def __len__(self):
+        # type: () -> int
+
+        return len(self._entries)
+
+    def append(self, index, direction, is_open):
+        # type: (int, int, bool) -> None
 
-    def close(self):
+        self._entries.append(index << 3 | direction << 1 | is_open)
+
+    def extend(self, entries):
+        # type: (Any) -> None
+
+        """
+        Append packed entries given as a buffer of int64, e.g. a NumPy array.
+        """
+
+        self._entries.frombytes(memoryview(entries).cast('B'))
+
+    def entries(self, start=0, stop=None):
+        # type: (int, int) -> array.array
+
+        return self._entries[start:stop]
+
+    def mark(self):
+        # type: () -> int
+
+        return len(self._entries)
+
+    def publish(self):
         # type: () -> None
 
-        self._is_open = False
+        for subscriber in self._subscribers:
+            if subscriber[1] < len(self._entries):
+                position = subscriber[1]
+                subscriber[1] = len(self._entries)
+                subscriber[0](self._entries[position:subscriber[1]])
+
+    def subscribe(self, callback):
+        # type: (Callable[[array.array], None]) -> None
+
+        """
+        Call 'callback' with the entries appended from now on, each time the journal is published.
+        """
 
-    def is_open(self):
-        # type: () -> bool
+        self._subscribers.append([callback, len(self._entries)])
 
-        return self._is_open
+    def unsubscribe(self, callback):
+        # type: (Callable[[array.array], None]) -> None
+
+        self._subscribers = [subscriber for subscriber in self._subscribers if subscriber[0] != callback]
+
+    @staticmethod
+    def unpack(entry):
+        # type: (int) -> Tuple[int, int, bool]
+
+        return entry >> 3, entry >> 1 & 3, entry & 1 == 1
 
 
 class Cell(object):
     """
-    Each cell is a square in the maze. Cells are separated by walls or passages (i.e. links). Cells have a field 'meta'
-    which can be used by algorithms for stored arbitrary data about this cell.
+    Each cell is a square in the maze. Cells are separated by walls or passages (i.e. links), which are stored in the
+    masks of the maze: a cell is a view on its maze at some coordinates. Two cells are equal if they are at the same
+    place in the same maze.
+
+    Cells have a field 'meta' which can be used for storing arbitrary data about this cell. The algorithms do not use
+    it: they keep track of the cells they visited in a :class:`Bitset` of the indices of the cells.
     """
 
-    def __init__(self, x, y, meta):
-        # type: (int, int, Any) -> None
+    def __init__(self, maze, x, y):
+        # type: (Maze, int, int) -> None
 
+        self._maze = maze  # type: Maze
         self._x = x  # type: int
         self._y = y  # type: int
-        self._meta = meta  # type: Any
-        self._neighbors = dict()  # type: Dict[Maze.Direction, Tuple[Cell, Link]]
+        self._index = y * maze.width() + x  # type: int
+
+    def __eq__(self, other):
+        # type: (Any) -> bool
+
+        return isinstance(other, Cell) and self._index == other._index and self._maze is other._maze
+
+    def __hash__(self):
+        # type: () -> int
+
+        return self._index
+
+    def __ne__(self, other):
+        # type: (Any) -> bool
+
+        return not self == other
 
     def __str__(self):
         # type: () -> str
 
         return '({}, {})'.format(self._x, self._y)
 
-    def add_neighbor(self, direction, neighbor, is_open):
-        # type: (Maze.Direction, Cell, bool) -> None
-
-        if direction not in self._neighbors:
-            self.replace_neighbor(direction, neighbor, is_open)
-
     def close(self, direction):
         # type: (Maze.Direction) -> None
 
-        self._neighbors[direction][1].close()
+        self._maze.set_link(self._index, direction.value - 1, False)
+
+    def close_at(self, code):
+        # type: (int) -> None
+
+        self._maze.set_link(self._index, code, False)
+
+    def index(self):
+        # type: () -> int
+
+        return self._index
 
     def is_open(self, direction):
         # type: (Maze.Direction) -> bool
 
-        return self._neighbors[direction][1].is_open()
+        return self._maze.is_link_open(self._index, direction.value - 1)
+
+    def is_open_at(self, code):
+        # type: (int) -> bool
+
+        return self._maze.is_link_open(self._index, code)
 
     def get_direction_with(self, other_cell):
         # type: (Cell) -> Maze.Direction
 
-        for direction in Maze.Direction:
-            if self.has_neighbor(direction) and self.get_neighbor(direction) is other_cell:
-                return direction
+        for code in DIRECTIONS:
+            if self.neighbor_at(code) == other_cell:
+                return Maze.Direction.from_code(code)
 
         raise ValueError('Cells {} and {} are not neighbors'.format(self, other_cell))
 
     def get_meta(self):
         # type: () -> Any
 
-        return self._meta
+        return self._maze._meta.get(self._index, self._maze._default_meta)
 
     def get_neighbor(self, direction):
         # type: (Maze.Direction) -> Cell
 
-        return self._neighbors[direction][0]
+        neighbor = self.neighbor_at(direction.value - 1)
+        if neighbor is None:
+            raise KeyError(direction)
+
+        return neighbor
 
     def get_neighbors(self):
         # type: () -> Set[Cell]
 
-        return {cell for cell, link in self._neighbors.items()}
+        return {neighbor for neighbor in map(self.neighbor_at, DIRECTIONS) if neighbor is not None}
 
     def has_neighbor(self, direction):
         # type: (Maze.Direction) -> bool
 
-        return direction in self._neighbors
+        return self.neighbor_at(direction.value - 1) is not None
+
+    def neighbor_at(self, code):
+        # type: (int) -> Union[Cell, None]
+
+        x = self._x + DX[code]
+        y = self._y + DY[code]
+        if 0 <= x < self._maze.width() and 0 <= y < self._maze.height():
+            return Cell(self._maze, x, y)
+
+        return None
 
     def open(self, direction):
         # type: (Maze.Direction) -> None
 
-        self._neighbors[direction][1].open()
+        self._maze.set_link(self._index, direction.value - 1, True)
+
+    def open_at(self, code):
+        # type: (int) -> None
+
+        self._maze.set_link(self._index, code, True)
 
     def replace_neighbor(self, direction, neighbor, is_open):
         # type: (Maze.Direction, Cell, bool) -> None
 
-        link = Link(is_open)
-        self._neighbors[direction] = (neighbor, link)
-        neighbor._neighbors[direction.opposite()] = (self, link)
+        if self.neighbor_at(direction.value - 1) != neighbor:
+            raise ValueError('Cells {} and {} are not neighbors'.format(self, neighbor))
+
+        self._maze.set_link(self._index, direction.value - 1, is_open)
 
     def set_meta(self, meta):
         # type: (Any) -> None
 
-        self._meta = meta
+        self._maze._meta[self._index] = meta
 
     def x(self):
         # type: () -> int
@@ -128,12 +454,17 @@ class Cell(object):
 class Maze(object):
     """
     A maze composed of cells.
+
+    The links of the maze are stored as one mask per cell, indexed by 'y * width + x'. The bit '1 << code' of a mask is
+    set when the cell is open in the direction with that code. The masks are split into pages of :data:`PAGE_SIZE`
+    cells. A copy of a maze shares its pages with the original, and a page is only copied when one of the two mazes
+    writes to it for the first time.
     """
 
     @enum.unique
     class Direction(enum.Enum):
         """
-
+        Public face of the directions. The integer code of a direction (see :data:`DIRECTIONS`) is ``value - 1``.
         """
 
         LEFT = 1
@@ -141,106 +472,154 @@ class Maze(object):
         RIGHT = 3
         DOWN = 4
 
+        def code(self):
+            # type: () -> int
+
+            return self.value - 1
+
+        @staticmethod
+        def from_code(code):
+            # type: (int) -> Maze.Direction
+
+            return _DIRECTIONS[code]
+
         def opposite(self):
             # type: (Maze.Direction) -> Maze.Direction
 
-            if self is Maze.Direction.LEFT:
-                return Maze.Direction.RIGHT
-            elif self is Maze.Direction.UP:
-                return Maze.Direction.DOWN
-            elif self is Maze.Direction.RIGHT:
-                return Maze.Direction.LEFT
-            elif self is Maze.Direction.DOWN:
-                return Maze.Direction.UP
+            return _DIRECTIONS[OPPOSITES[self.value - 1]]
 
         def others(self):
             # type: () -> Set[Maze.Direction]
 
-            return set(Maze.Direction) - {self}
+            return _OTHERS[self.value - 1]
 
         def perpendiculars(self):
             # type: (Maze.Direction) -> Set[Maze.Direction]
 
-            if self in {Maze.Direction.LEFT, Maze.Direction.RIGHT}:
-                return {Maze.Direction.UP, Maze.Direction.DOWN}
-            else:
-                return {Maze.Direction.LEFT, Maze.Direction.RIGHT}
+            return _PERPENDICULARS[self.value - 1]
 
         @staticmethod
         def shuffle():
             # type: () -> List[Maze.Direction]
 
-            directions = list(Maze.Direction)
-            random.shuffle(directions)
-            return directions
+            return [_DIRECTIONS[code] for code in PERMUTATIONS[random.randrange(NUM_PERMUTATIONS)]]
 
-    # TODO: Make a class out of 'sub_mazes'.
+    # See layout.Layout for compositions of sub mazes given by regions.
     def __init__(self, width, height, carving, meta=None, sub_mazes=None):
         # type: (int, int, bool, Any, List[Tuple[Maze, List[Tuple[int, int, Maze.Direction, bool]], Tuple[int, int]]]) -> None
 
-        self._grid = [[Cell(x, y, meta) for y in range(height)] for x in range(width)]  # type: List[List[Cell]]
+        num_pages = (width * height + PAGE_MASK) >> PAGE_SHIFT
         self._width = width  # type: int
         self._height = height  # type: int
-
-        # Set links between cells.
-        for y in range(height):
-            for x in range(width):
-                if x > 0:
-                    self.cell(x, y).add_neighbor(Maze.Direction.LEFT, self.cell(x - 1, y), not carving)
-                if y > 0:
-                    self.cell(x, y).add_neighbor(Maze.Direction.UP, self.cell(x, y - 1), not carving)
-                if x < self.width() - 1:
-                    self.cell(x, y).add_neighbor(Maze.Direction.RIGHT, self.cell(x + 1, y), not carving)
-                if y < self.height() - 1:
-                    self.cell(x, y).add_neighbor(Maze.Direction.DOWN, self.cell(x, y + 1), not carving)
+        self._default_meta = meta  # type: Any
+        self._meta = dict()  # type: Dict[int, Any]
+        self._sub_maze_cells = Bitset(width * height)  # type: Bitset
+        self._journal = None  # type: Union[Journal, None]
+
+        # Set links between cells: the pages of the masks are shared (see :meth:`_writable_page`), so a maze is built
+        # with one page of closed links, or with the few distinct pages of open links.
+        if carving:
+            self._pages = [ZERO_PAGE] * num_pages  # type: List[Union[bytes, bytearray]]
+        else:
+            self._pages = Maze._open_pages(width, height)
+        self._shared = bytearray(b'\x01') * num_pages  # type: bytearray
 
         # Insert sub mazes if there are some.
         if sub_mazes is None:
             sub_mazes = list()
         for sub_maze, special_cases, (sub_x, sub_y) in sub_mazes:
-            for y in range(sub_maze.height()):
-                for x in range(sub_maze.width()):
-                    abs_x = sub_x + x
-                    abs_y = sub_y + y
-                    self._grid[abs_x][abs_y] = sub_maze.cell(x, y)
-
-                    # Reconnect adjacent cells.
-                    if abs_x > 0 and x is 0:
-                        self.cell(abs_x, abs_y).replace_neighbor(Maze.Direction.LEFT,
-                                                                 self.cell(abs_x - 1, abs_y), not carving)
-                    if abs_y > 0 and y is 0:
-                        self.cell(abs_x, abs_y).replace_neighbor(Maze.Direction.UP,
-                                                                 self.cell(abs_x, abs_y - 1), not carving)
-                    if abs_x < self.width() - 1 and x is sub_maze.width() - 1:
-                        self.cell(abs_x, abs_y).replace_neighbor(Maze.Direction.RIGHT,
-                                                                 self.cell(abs_x + 1, abs_y), not carving)
-                    if abs_y < self.height() - 1 and y is sub_maze.height() - 1:
-                        self.cell(abs_x, abs_y).replace_neighbor(Maze.Direction.DOWN,
-                                                                 self.cell(abs_x, abs_y + 1), not carving)
+            self.place(sub_maze, sub_x, sub_y, not carving)
 
             # Open or close some cells in some directions.
             for x, y, direction, is_open in special_cases:
-                if is_open:
-                    sub_maze.cell(x, y).open(direction)
-                else:
-                    sub_maze.cell(x, y).close(direction)
+                self.set_link((sub_y + y) * width + sub_x + x, direction.code(), is_open)
+
+    def carve(self, edges):
+        # type: (Iterable[Tuple[int, int, int]]) -> None
+
+        """
+        Open the links of a sequence of edges (x, y, direction code), e.g. a path computed at once, without going
+        through the cells.
+        """
+
+        width = self._width
+        height = self._height
+        for x, y, direction in edges:
+            neighbor_x = x + DX[direction]
+            neighbor_y = y + DY[direction]
+            if not (0 <= x < width and 0 <= y < height and 0 <= neighbor_x < width and 0 <= neighbor_y < height):
+                raise ValueError('Cell ({}, {}) has no neighbor in direction {}'.format(x, y, direction))
+            index = y * width + x
+            if self._journal is not None:
+                self.set_link(index, direction, True)
+                continue
+            neighbor = neighbor_y * width + neighbor_x
+            self._writable_page(index >> PAGE_SHIFT)[index & PAGE_MASK] |= 1 << direction
+            self._writable_page(neighbor >> PAGE_SHIFT)[neighbor & PAGE_MASK] |= 1 << OPPOSITES[direction]
 
     def cell(self, x, y):
         # type: (int, int) -> Cell
 
-        return self._grid[x][y]
+        if not (0 <= x < self._width and 0 <= y < self._height):
+            raise IndexError('Cell ({}, {}) is out of the maze'.format(x, y))
+
+        return Cell(self, x, y)
+
+    def copy(self):
+        # type: () -> Maze
+
+        """
+        Return a copy of this maze. The copy costs one reference per page: the pages are only copied when they are
+        written to.
+        """
+
+        maze = Maze.__new__(Maze)
+        maze._width = self._width
+        maze._height = self._height
+        maze._pages = list(self._pages)
+        self._shared[:] = b'\x01' * len(self._shared)
+        maze._shared = bytearray(self._shared)
+        maze._default_meta = self._default_meta
+        maze._meta = dict(self._meta)
+        maze._sub_maze_cells = self._sub_maze_cells.copy()
+        maze._journal = None
+        return maze
+
+    def disable_journal(self):
+        # type: () -> None
+
+        """
+        Stop recording the changes of the links of this maze, and drop the journal.
+        """
+
+        self._journal = None
+
+    def enable_journal(self):
+        # type: () -> Journal
+
+        """
+        Start recording the changes of the links of this maze, and return the journal. The journal is not copied along
+        with the maze.
+        """
+
+        if self._journal is None:
+            self._journal = Journal()
+
+        return self._journal
 
     def export_to_full_grid(self, spaces, walls):
         # type: (Any, Any) -> List[List[int]]
 
         exported_maze = [[walls for _ in range(self.height() * 2 + 1)] for _ in range(self.width() * 2 + 1)]
+        masks = self._masks()
 
         for x in range(self.width()):
             for y in range(self.height()):
+                mask = masks[y * self._width + x]
                 exported_maze[x * 2 + 1][y * 2 + 1] = spaces
-                if self.cell(x, y).has_neighbor(Maze.Direction.RIGHT) and self.cell(x, y).is_open(Maze.Direction.RIGHT):
+                if mask & (1 << RIGHT):
                     exported_maze[x * 2 + 2][y * 2 + 1] = spaces
-                if self.cell(x, y).has_neighbor(Maze.Direction.DOWN) and self.cell(x, y).is_open(Maze.Direction.DOWN):
+                if mask & (1 << DOWN):
                     exported_maze[x * 2 + 1][y * 2 + 2] = spaces
 
         return exported_maze
@@ -248,27 +627,617 @@ class Maze(object):
     def export_to_bits(self):
         # type: () -> List[List[int]]
 
-        exported_maze = [[0 for _ in range(self.height())] for _ in range(self.width())]
+        masks = self._masks()
 
-        for y in range(self.height()):
-            for x in range(self.width()):
-                if self.cell(x, y).has_neighbor(Maze.Direction.LEFT) and self.cell(x, y).is_open(Maze.Direction.LEFT):
-                    exported_maze[x][y] |= 1
-                if self.cell(x, y).has_neighbor(Maze.Direction.UP) and self.cell(x, y).is_open(Maze.Direction.UP):
-                    exported_maze[x][y] |= 2
-                if self.cell(x, y).has_neighbor(Maze.Direction.RIGHT) and self.cell(x, y).is_open(Maze.Direction.RIGHT):
-                    exported_maze[x][y] |= 4
-                if self.cell(x, y).has_neighbor(Maze.Direction.DOWN) and self.cell(x, y).is_open(Maze.Direction.DOWN):
-                    exported_maze[x][y] |= 8
+        return [list(masks[x::self._width]) for x in range(self._width)]
 
-        return exported_maze
+    def export_to_bytes(self):
+        # type: () -> bytes
+
+        """
+        Export the maze in its binary format: a header (see :data:`BYTES_HEADER`) followed by the masks of the cells,
+        one byte per cell, row after row.
+        """
+
+        return BYTES_HEADER.pack(BYTES_MAGIC, self._width, self._height) + self._masks()
+
+    def export_to_masks(self):
+        # type: () -> bytes
+
+        """
+        Export the masks of the cells, one byte per cell, row after row (e.g. for NumPy's frombuffer).
+        """
+
+        return self._masks()
+
+    def export_to_png(self):
+        # type: () -> bytes
+
+        """
+        Export the maze as a grayscale PNG image with the layout of :meth:`export_to_full_grid`: one pixel per cell and
+        per wall.
+        """
+
+        width = self._width
+        masks = self._masks()
+        image_width = width * 2 + 1
+        rows = [bytes(image_width + 1)]  # Each row is a filter byte, then the pixels.
+        for y in range(self._height):
+            row_masks = masks[y * width:(y + 1) * width]
+            cells_row = bytearray(image_width + 1)
+            cells_row[2::2] = bytes((PNG_SPACE,)) * width
+            cells_row[3::2] = row_masks.translate(PNG_RIGHT)
+            walls_row = bytearray(image_width + 1)
+            walls_row[2::2] = row_masks.translate(PNG_DOWN)
+            rows.append(cells_row)
+            rows.append(walls_row)
+
+        def chunk(kind, data):
+            # type: (bytes, bytes) -> bytes
+
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+        return (b'\x89PNG\r\n\x1a\n' +
+                chunk(b'IHDR', struct.pack('>IIBBBBB', image_width, self._height * 2 + 1, 8, 0, 0, 0, 0)) +
+                chunk(b'IDAT', zlib.compress(b''.join(rows), 6)) +
+                chunk(b'IEND', b''))
+
+    @staticmethod
+    def from_bytes(data):
+        # type: (bytes) -> Maze
+
+        magic, width, height = BYTES_HEADER.unpack_from(data)
+        if magic != BYTES_MAGIC or len(data) != BYTES_HEADER.size + width * height:
+            raise ValueError('Invalid maze data')
+
+        maze = Maze(width, height, True)
+        for page in range(len(maze._pages)):
+            start = BYTES_HEADER.size + (page << PAGE_SHIFT)
+            maze._pages[page] = bytearray(data[start:start + PAGE_SIZE].ljust(PAGE_SIZE, b'\x00'))
+            maze._shared[page] = 0
+
+        return maze
 
     def height(self):
         # type: () -> int
 
         return self._height
 
+    def journal(self):
+        # type: () -> Union[Journal, None]
+
+        return self._journal
+
+    def is_link_open(self, index, direction):
+        # type: (int, int) -> bool
+
+        return self._pages[index >> PAGE_SHIFT][index & PAGE_MASK] >> direction & 1 == 1
+
+    def mask(self, index):
+        # type: (int) -> int
+
+        return self._pages[index >> PAGE_SHIFT][index & PAGE_MASK]
+
+    def neighborhoods(self, indices, visited=None):
+        # type: (Any, Any) -> Tuple[Any, Any, Any]
+
+        """
+        Return three NumPy arrays of masks for an array of cell indices, with the bits of the directions as in the masks
+        of the cells: the open links of the cells, the directions in which they have neighbors, and the directions in
+        which they have neighbors not in 'visited' (a Bitset or an array of booleans by cell index; without it, all the
+        neighbors).
+        """
+
+        if numpy is None:
+            raise RuntimeError('NumPy is required for querying arrays of cells')
+
+        width = self._width
+        num_cells = width * self._height
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        if len(indices) and (indices.min() < 0 or indices.max() >= num_cells):
+            raise IndexError('Cell indices out of the maze of {} cells'.format(num_cells))
+
+        masks = self._gather_masks(indices)
+        columns = indices % width
+        exists = numpy.stack(((columns > 0), (indices >= width), (columns < width - 1), (indices < num_cells - width)))
+        neighbor_masks = numpy.zeros(len(indices), dtype=numpy.uint8)
+        for direction in DIRECTIONS:
+            neighbor_masks |= exists[direction].astype(numpy.uint8) << direction
+        if visited is None:
+            return masks, neighbor_masks, neighbor_masks.copy()
+
+        neighbors = numpy.where(exists, indices + numpy.array((-1, -width, 1, width), dtype=numpy.int64)[:, None], 0)
+        if isinstance(visited, Bitset):
+            is_free = exists & ~visited.lookup(neighbors)
+        else:
+            is_free = exists & ~numpy.asarray(visited, dtype=numpy.bool_)[neighbors]
+        unvisited_masks = numpy.zeros(len(indices), dtype=numpy.uint8)
+        for direction in DIRECTIONS:
+            unvisited_masks |= is_free[direction].astype(numpy.uint8) << direction
+
+        return masks, neighbor_masks, unvisited_masks
+
+    def neighbor_index(self, index, direction):
+        # type: (int, int) -> int
+
+        """
+        Return the index of the neighbor of a cell in a direction, or -1 if the cell has no neighbor in that direction.
+        """
+
+        if direction == LEFT:
+            return index - 1 if index % self._width > 0 else -1
+        elif direction == UP:
+            return index - self._width if index >= self._width else -1
+        elif direction == RIGHT:
+            return index + 1 if index % self._width < self._width - 1 else -1
+        else:
+            return index + self._width if index + self._width < self._width * self._height else -1
+
+    def new_visited(self):
+        # type: () -> Bitset
+
+        """
+        Return the bitset of visited cells for a new run of an algorithm on this maze. The cells carved in the sub
+        mazes are already built, so they start as visited.
+        """
+
+        return self._sub_maze_cells.copy()
+
+    def open_links(self, indices, directions):
+        # type: (Any, Any) -> None
+
+        """
+        Open the links of arrays of cell indices and direction codes at once, e.g. the links decided by an algorithm
+        which works by arrays. The masks are updated with NumPy, page by page.
+        """
+
+        if numpy is None:
+            raise RuntimeError('NumPy is required for opening arrays of links')
+
+        width = self._width
+        num_cells = width * self._height
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        directions = numpy.asarray(directions, dtype=numpy.int64)
+        neighbors = indices + numpy.array((-1, -width, 1, width), dtype=numpy.int64)[directions & 3]
+        columns = indices % width
+        is_valid = ((directions >= 0) & (directions < 4) & (indices >= 0) & (indices < num_cells) & (neighbors >= 0) &
+                    (neighbors < num_cells) & ~((directions == LEFT) & (columns == 0)) &
+                    ~((directions == RIGHT) & (columns == width - 1)))
+        if not is_valid.all():
+            position = int(numpy.argmin(is_valid))
+            raise ValueError('Cell {} has no neighbor in direction {}'.format(indices[position], directions[position]))
+
+        if not len(indices):
+            return
+        if self._journal is not None:
+            # As with set_link, each link which was closed is recorded once, where it first appears.
+            keys = numpy.where(directions < 2, neighbors, indices) << 1 | (directions & 1)
+            _, firsts = numpy.unique(keys, return_index=True)
+            firsts.sort()
+            is_closed = (self._gather_masks(indices[firsts]) >> directions[firsts] & 1) == 0
+            firsts = firsts[is_closed]
+            self._journal.extend(indices[firsts] << 3 | directions[firsts] << 1 | 1)
+
+        # Bits to add to the cells, merged in a buffer over the range of the cells when it is dense enough, or else by
+        # sorting the cells.
+        cells = numpy.concatenate((indices, neighbors))
+        bits = numpy.left_shift(1, numpy.concatenate((directions, (directions + 2) & 3))).astype(numpy.uint8)
+        first = int(cells.min()) & ~PAGE_MASK
+        stop = int(cells.max()) + 1
+        if stop - first <= 8 * len(cells):
+            buffer = numpy.zeros(stop - first, dtype=numpy.uint8)
+            numpy.bitwise_or.at(buffer, cells - first, bits)
+            for start in range(first, stop, PAGE_SIZE):
+                block = buffer[start - first:start - first + PAGE_SIZE]
+                if block.any():
+                    page = numpy.frombuffer(self._writable_page(start >> PAGE_SHIFT), dtype=numpy.uint8)
+                    page[:len(block)] |= block
+            return
+
+        order = numpy.argsort(cells, kind='stable')
+        cells = cells[order]
+        bits = bits[order]
+        starts = numpy.flatnonzero(numpy.concatenate(([True], cells[1:] != cells[:-1])))
+        cells = cells[starts]
+        bits = numpy.bitwise_or.reduceat(bits, starts)
+
+        pages = cells >> PAGE_SHIFT
+        bounds = numpy.flatnonzero(numpy.concatenate(([True], pages[1:] != pages[:-1]))).tolist() + [len(cells)]
+        for start, stop in zip(bounds, bounds[1:]):
+            page = numpy.frombuffer(self._writable_page(int(pages[start])), dtype=numpy.uint8)
+            offsets = cells[start:stop] & PAGE_MASK
+            page[offsets] |= bits[start:stop]
+
+    def place(self, sub_maze, x, y, is_border_open=False):
+        # type: (Maze, int, int, bool) -> None
+
+        """
+        Copy a maze into this one at (x, y), by rows, and add its carved cells (those with an open link) to the sub maze
+        cells: the others are left to the algorithms which run on this maze. The links across the border of the copied
+        region are set to 'is_border_open', on both sides.
+        """
+
+        width = self._width
+        sub_width = sub_maze.width()
+        sub_height = sub_maze.height()
+        if x < 0 or y < 0 or x + sub_width > width or y + sub_height > self._height:
+            raise ValueError('A maze of {}x{} at ({}, {}) is out of the maze'.format(sub_width, sub_height, x, y))
+
+        # The outward links of the border cells are written with the rows, the other sides of those links afterwards.
+        sub_masks = sub_maze._masks()
+        masks = bytearray(sub_masks)
+        border = list()  # type: List[Tuple[int, int]]
+        for direction, has_neighbors, positions in (
+                (LEFT, x > 0, range(0, len(masks), sub_width)),
+                (UP, y > 0, range(sub_width)),
+                (RIGHT, x + sub_width < width, range(sub_width - 1, len(masks), sub_width)),
+                (DOWN, y + sub_height < self._height, range(len(masks) - sub_width, len(masks)))):
+            if not has_neighbors:
+                continue
+            for position in positions:
+                if is_border_open:
+                    masks[position] |= 1 << direction
+                else:
+                    masks[position] &= ~(1 << direction)
+                border.append(((y + position // sub_width) * width + x + position % sub_width, direction))
+
+        for row in range(sub_height):
+            start = (y + row) * width + x
+            self.write_masks(start, masks[row * sub_width:(row + 1) * sub_width])
+            row_masks = sub_masks[row * sub_width:(row + 1) * sub_width]
+            if 0 not in row_masks:
+                self._sub_maze_cells.add_range(start, start + sub_width)
+            else:
+                for position, mask in enumerate(row_masks):
+                    if mask:
+                        self._sub_maze_cells.add(start + position)
+
+        for index, direction in border:
+            neighbor = self.neighbor_index(index, direction)
+            bit = 1 << OPPOSITES[direction]
+            mask = self.mask(neighbor)
+            if bool(mask & bit) is not is_border_open:
+                self._writable_page(neighbor >> PAGE_SHIFT)[neighbor & PAGE_MASK] = mask ^ bit
+
+    def regenerate_region(self, x, y, width, height, algorithm, parameters=None, rng=None):
+        # type: (int, int, int, int, Any, Any, Any) -> None
+
+        """
+        Carve again the rectangle of 'width' x 'height' cells at (x, y) with an algorithm, keeping the links across its
+        border, so that a perfect maze stays perfect. The cost is proportional to the rectangle.
+
+        The old links within the rectangle split its cells into groups, each of them linked to the rest of the maze
+        through its own links across the border. The new links must group the cells the same way: the links of a maze
+        generated by the algorithm are taken in a random order, then the other links of the grid, by a Kruskal algorithm
+        which never unites two groups (see :class:`DisjointSet`). If the groups cannot all be rebuilt that way, the
+        old paths between the border links of each group are kept, and the rest is carved again.
+        """
+
+        from randomness import RandomSource  # Not at the top: the random sources depend on this module.
+
+        if x < 0 or y < 0 or width <= 0 or height <= 0 or x + width > self._width or y + height > self._height:
+            raise ValueError('The region of {}x{} at ({}, {}) is out of the maze'.format(width, height, x, y))
+        if rng is None:
+            rng = RandomSource()
+
+        num_cells = width * height
+        old_masks = b''.join(self._read_masks((y + row) * self._width + x, width) for row in range(height))
+        # Links of the region (cell, direction), by their first cell.
+        old_links = [(cell, direction) for cell in range(num_cells) for direction in (RIGHT, DOWN)
+                     if old_masks[cell] >> direction & 1 and
+                     (cell % width < width - 1 if direction == RIGHT else cell + width < num_cells)]
+
+        # Links across the border, which are kept, and the group of the cells which have some.
+        outward = bytearray(num_cells)
+        for direction, has_neighbors, cells in (
+                (LEFT, x > 0, range(0, num_cells, width)),
+                (UP, y > 0, range(width)),
+                (RIGHT, x + width < self._width, range(width - 1, num_cells, width)),
+                (DOWN, y + height < self._height, range(num_cells - width, num_cells))):
+            if has_neighbors:
+                for cell in cells:
+                    outward[cell] |= 1 << direction
+        border_masks = bytes(old_mask & outward_mask for old_mask, outward_mask in zip(old_masks, outward))
+        groups = DisjointSet(num_cells)
+        for cell, direction in old_links:
+            groups.union(cell, cell + (1 if direction == RIGHT else width))
+        labels = dict((cell, groups.find(cell)) for cell in range(num_cells) if border_masks[cell])
+        num_groups = max(1, len(set(labels.values())))
+
+        # Links of a maze of the algorithm, then the other ones.
+        maze = algorithm.start(width, height, parameters, rng).finish()
+        new_masks = maze.export_to_masks()
+        links = [(cell, direction) for cell in range(num_cells) for direction in (RIGHT, DOWN)
+                 if (cell % width < width - 1 if direction == RIGHT else cell + width < num_cells)]
+        preferred = [link for link in links if new_masks[link[0]] >> link[1] & 1]
+        others = [link for link in links if not new_masks[link[0]] >> link[1] & 1]
+        rng.shuffle(preferred)
+        rng.shuffle(others)
+
+        kept = Maze._border_paths(old_links, labels, num_cells, width)
+        for candidates in (preferred + others, kept + preferred + others):
+            cells = DisjointSet(num_cells)
+            set_labels = dict((cell, label) for cell, label in labels.items())
+            chosen = list()
+            for cell, direction in candidates:
+                neighbor = cell + (1 if direction == RIGHT else width)
+                root = cells.find(cell)
+                neighbor_root = cells.find(neighbor)
+                label = set_labels.get(root)
+                neighbor_label = set_labels.get(neighbor_root)
+                if root == neighbor_root or (label is not None and neighbor_label is not None and
+                                             label != neighbor_label):
+                    continue
+                set_labels[cells.union(root, neighbor_root)] = label if label is not None else neighbor_label
+                chosen.append((cell, direction))
+                if cells.num_sets() == num_groups:
+                    break
+            if cells.num_sets() == num_groups:
+                break
+
+        masks = bytearray(border_masks)
+        for cell, direction in chosen:
+            masks[cell] |= 1 << direction
+            masks[cell + (1 if direction == RIGHT else width)] |= 1 << OPPOSITES[direction]
+        for row in range(height):
+            self.write_masks((y + row) * self._width + x, masks[row * width:(row + 1) * width])
+
+    def set_link(self, index, direction, is_open):
+        # type: (int, int, bool) -> None
+
+        """
+        Open or close the link of a cell in a direction, on both sides of the link.
+        """
+
+        neighbor = self.neighbor_index(index, direction)
+        if neighbor < 0:
+            raise ValueError('Cell {} has no neighbor in direction {}'.format(index, direction))
+
+        if self._journal is not None:
+            if self.is_link_open(index, direction) is bool(is_open):
+                return
+            self._journal.append(index, direction, is_open)
+
+        if is_open:
+            self._writable_page(index >> PAGE_SHIFT)[index & PAGE_MASK] |= 1 << direction
+            self._writable_page(neighbor >> PAGE_SHIFT)[neighbor & PAGE_MASK] |= 1 << OPPOSITES[direction]
+        else:
+            self._writable_page(index >> PAGE_SHIFT)[index & PAGE_MASK] &= ~(1 << direction)
+            self._writable_page(neighbor >> PAGE_SHIFT)[neighbor & PAGE_MASK] &= ~(1 << OPPOSITES[direction])
+
+    def sub_maze_cells(self):
+        # type: () -> Bitset
+
+        return self._sub_maze_cells
+
+    def undo(self, mark):
+        # type: (int) -> None
+
+        """
+        Revert the links changed since a mark of the journal. The reverting changes are themselves appended to the
+        journal, so that subscribers see them like any other change.
+        """
+
+        if self._journal is None:
+            raise RuntimeError('The journal of the maze is not enabled')
+
+        for entry in reversed(self._journal.entries(mark)):
+            self.set_link(entry >> 3, entry >> 1 & 3, not entry & 1)
+
     def width(self):
         # type: () -> int
 
         return self._width
+
+    def write_masks(self, start, masks):
+        # type: (int, Any) -> None
+
+        """
+        Overwrite the masks of the cells from index 'start' on with the masks of a bytes-like object (e.g. a NumPy array
+        of uint8), by copies of whole buffers. The links with cells out of the written range must also be written on
+        their other side, before or after (e.g. when a maze is written by blocks of rows).
+
+        If the journal is enabled, each changed link is recorded once: a link with a cell out of the range is recorded if
+        it differs from the mask of that cell. The changes are found with NumPy if it is available, cell by cell else.
+        """
+
+        masks = memoryview(masks).cast('B')
+        if self._journal is not None and numpy is not None:
+            if len(masks):
+                self._journal_masks(start, masks)
+        elif self._journal is not None:
+            stop = start + len(masks)
+            for position in range(len(masks)):
+                index = start + position
+                old_mask = self.mask(index)
+                for direction in DIRECTIONS:
+                    neighbor = self.neighbor_index(index, direction)
+                    if neighbor < 0:
+                        continue
+                    if start <= neighbor < stop:
+                        if neighbor < index:
+                            continue  # Recorded with the neighbor.
+                        was_open = old_mask >> direction & 1
+                    else:
+                        was_open = self.mask(neighbor) >> OPPOSITES[direction] & 1
+                    if masks[position] >> direction & 1 != was_open:
+                        self._journal.append(index, direction, masks[position] >> direction & 1)
+
+        position = 0
+        while position < len(masks):
+            index = start + position
+            page = index >> PAGE_SHIFT
+            offset = index & PAGE_MASK
+            count = min(PAGE_SIZE - offset, len(masks) - position)
+            if count == PAGE_SIZE:
+                self._pages[page] = bytearray(masks[position:position + count])
+                self._shared[page] = 0
+            else:
+                self._writable_page(page)[offset:offset + count] = masks[position:position + count]
+            position += count
+
+    @staticmethod
+    def _border_paths(links, labels, num_cells, width):
+        # type: (List[Tuple[int, int]], Dict[int, int], int, int) -> List[Tuple[int, int]]
+
+        """
+        Return the links of a forest which lie on the paths between its labelled cells: the branches without labelled
+        cells are pruned, leaf after leaf.
+        """
+
+        neighbors = [list() for _ in range(num_cells)]  # type: List[List[int]]
+        for cell, direction in links:
+            neighbor = cell + (1 if direction == RIGHT else width)
+            neighbors[cell].append(neighbor)
+            neighbors[neighbor].append(cell)
+        degrees = [len(cell_neighbors) for cell_neighbors in neighbors]
+        is_pruned = bytearray(num_cells)
+        leaves = [cell for cell in range(num_cells) if degrees[cell] <= 1 and cell not in labels]
+        while leaves:
+            cell = leaves.pop()
+            is_pruned[cell] = 1
+            for neighbor in neighbors[cell]:
+                if not is_pruned[neighbor]:
+                    degrees[neighbor] -= 1
+                    if degrees[neighbor] <= 1 and neighbor not in labels:
+                        leaves.append(neighbor)
+
+        return [(cell, direction) for cell, direction in links
+                if not is_pruned[cell] and not is_pruned[cell + (1 if direction == RIGHT else width)]]
+
+    def _gather_masks(self, indices):
+        # type: (Any) -> Any
+
+        """
+        Return the masks of an array of cell indices as an array of uint8, gathered page by page.
+        """
+
+        masks = numpy.empty(len(indices), dtype=numpy.uint8)
+        pages = indices >> PAGE_SHIFT
+        order = numpy.argsort(pages, kind='stable')
+        pages = pages[order]
+        bounds = numpy.flatnonzero(numpy.concatenate(([len(pages) > 0], pages[1:] != pages[:-1]))).tolist()
+        for start, stop in zip(bounds, bounds[1:] + [len(indices)]):
+            positions = order[start:stop]
+            page = numpy.frombuffer(self._pages[int(pages[start])], dtype=numpy.uint8)
+            masks[positions] = page[indices[positions] & PAGE_MASK]
+
+        return masks
+
+    def _journal_masks(self, start, masks):
+        # type: (int, Any) -> None
+
+        """
+        Record in the journal the changes of the links made by writing masks from index 'start' on (see
+        :meth:`write_masks`), with NumPy: each link within the range is recorded by its cell with the lower index, and a
+        link with a cell out of the range if it differs from the mask of that cell. The entries are in the order of the
+        cells, then of the directions.
+        """
+
+        width = self._width
+        num_cells = width * self._height
+        stop = start + len(masks)
+        new_masks = numpy.frombuffer(masks, dtype=numpy.uint8)
+        # Old masks of the range and of the rows around it, where the neighbors out of the range are.
+        first = max(start - width, 0)
+        around = numpy.frombuffer(self._read_masks(first, min(stop + width, num_cells) - first), dtype=numpy.uint8)
+        old_masks = around[start - first:stop - first]
+        indices = numpy.arange(start, stop, dtype=numpy.int64)
+        columns = indices % width
+
+        changes = list()  # type: List[Any]
+        for direction, exists in ((LEFT, columns > 0), (UP, indices >= width), (RIGHT, columns < width - 1),
+                                  (DOWN, indices < num_cells - width)):
+            neighbors = indices + (DX[direction] + DY[direction] * width)
+            is_inside = (neighbors >= start) & (neighbors < stop)
+            if direction in (LEFT, UP):
+                exists &= ~is_inside  # Recorded with the neighbor.
+            neighbor_masks = around[numpy.where(exists, neighbors - first, 0)]
+            was_open = numpy.where(is_inside, old_masks >> direction, neighbor_masks >> OPPOSITES[direction]) & 1
+            is_open = new_masks >> direction & 1
+            changed = numpy.flatnonzero(exists & (is_open != was_open))
+            changes.append(indices[changed] << 3 | direction << 1 | is_open[changed])
+
+        self._journal.extend(numpy.sort(numpy.concatenate(changes)))
+
+    def _masks(self):
+        # type: () -> bytes
+
+        return b''.join(self._pages)[:self._width * self._height]
+
+    @staticmethod
+    def _open_pages(width, height):
+        # type: (int, int) -> List[bytes]
+
+        """
+        Return the pages of a maze of which all the links are open. The masks of the rows between the first and the
+        last ones repeat with the width of the maze, so the pages within those rows are shared by offset in the rows.
+        """
+
+        num_cells = width * height
+        if num_cells == 0:
+            return list()
+        if width > 1:
+            row = bytes((1 << RIGHT,)) + bytes((1 << LEFT | 1 << RIGHT,)) * (width - 2) + bytes((1 << LEFT,))
+        else:
+            row = bytes(1)
+        rows = row.translate(bytes(mask | 1 << UP | 1 << DOWN for mask in range(256))) * (PAGE_SIZE // width + 2)
+        without_up = bytes(mask & ~(1 << UP) for mask in range(256))
+        without_down = bytes(mask & ~(1 << DOWN) for mask in range(256))
+
+        pages = list()  # type: List[bytes]
+        middle_pages = dict()  # type: Dict[int, bytes]
+        for start in range(0, num_cells, PAGE_SIZE):
+            offset = start % width
+            stop = min(start + PAGE_SIZE, num_cells)
+            if width <= start and stop <= num_cells - width:
+                if offset not in middle_pages:
+                    middle_pages[offset] = rows[offset:offset + PAGE_SIZE]
+                pages.append(middle_pages[offset])
+            else:
+                page = bytearray(rows[offset:offset + stop - start])
+                if start < width:
+                    page[:width - start] = page[:width - start].translate(without_up)
+                if stop > num_cells - width:
+                    last_row = max(0, num_cells - width - start)
+                    page[last_row:] = page[last_row:].translate(without_down)
+                pages.append(bytes(page.ljust(PAGE_SIZE, b'\x00')))
+
+        return pages
+
+    def _read_masks(self, start, count):
+        # type: (int, int) -> bytes
+
+        """
+        Return the masks of 'count' cells from index 'start' on.
+        """
+
+        chunks = list()  # type: List[bytes]
+        while count > 0:
+            offset = start & PAGE_MASK
+            size = min(PAGE_SIZE - offset, count)
+            chunks.append(self._pages[start >> PAGE_SHIFT][offset:offset + size])
+            start += size
+            count -= size
+
+        return b''.join(chunks)
+
+    def _writable_page(self, page):
+        # type: (int) -> bytearray
+
+        """
+        Return a page which can be written to. Pages can be shared by several mazes (see :meth:`copy`) or several places
+        of a maze (see :data:`ZERO_PAGE`): a shared page is copied on its first write.
+        """
+
+        if self._shared[page]:
+            self._pages[page] = bytearray(self._pages[page])
+            self._shared[page] = 0
+
+        return self._pages[page]
+
+
+# Lookup tables backing Maze.Direction. They can only be built once the enumeration exists.
+_DIRECTIONS = tuple(Maze.Direction)  # type: Tuple[Maze.Direction, ...]
+_OTHERS = tuple(frozenset(_DIRECTIONS[other] for other in OTHERS[code]) for code in DIRECTIONS)  # type: Tuple[Set[Maze.Direction], ...]
+_PERPENDICULARS = tuple(frozenset(_DIRECTIONS[other] for other in PERPENDICULARS[code]) for code in DIRECTIONS)  # type: Tuple[Set[Maze.Direction], ...]
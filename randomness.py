@@ -0,0 +1,149 @@
+import random
+import struct
+
+from maze import NUM_PERMUTATIONS, PERMUTATIONS
+
+try:
+    from typing import Any, Callable, Dict, List, MutableSequence, Sequence, Set, Tuple
+except ImportError:
+    Any, Callable, Dict, List, MutableSequence, Sequence, Set, Tuple = None, None, None, None, None, None, None, None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class RandomSource(object):
+    """
+    Source of random numbers for the algorithms. Random bits are drawn from the underlying generator by blocks of
+    32-bit words, and the small draws the algorithms need (ranges, floats, orderings of the directions, ...) are served
+    from that buffer.
+
+    The underlying generator is either a :class:`random.Random` seeded with the given seed, or a NumPy ``Generator``.
+    Two sources built with the same seed produce the same draws, in any process and on any platform.
+    """
+
+    BLOCK_SIZE = 4096  # Number of words drawn at once.
+
+    def __init__(self, seed=None, generator=None):
+        # type: (Any, Any) -> None
+
+        self._random = random.Random(seed)  # type: random.Random
+        self._generator = generator  # type: Any
+        self._next_word = iter(()).__next__  # type: Callable[[], int]
+
+    def __getstate__(self):
+        # type: () -> Dict[str, Any]
+
+        # Only the words left in the buffer are saved.
+        words = tuple(self._next_word.__self__)
+        self._next_word = iter(words).__next__
+        state = dict(self.__dict__)
+        state['_next_word'] = words
+        return state
+
+    def __setstate__(self, state):
+        # type: (Dict[str, Any]) -> None
+
+        self.__dict__.update(state)
+        self._next_word = iter(state['_next_word']).__next__
+
+    def choice(self, sequence):
+        # type: (Sequence[Any]) -> Any
+
+        return sequence[self.randrange(len(sequence))]
+
+    def permutation(self):
+        # type: () -> Tuple[int, ...]
+
+        """
+        Return a random ordering of the direction codes.
+        """
+
+        try:
+            product = self._next_word() * NUM_PERMUTATIONS
+        except StopIteration:
+            product = self._refill() * NUM_PERMUTATIONS
+        if (product & 0xFFFFFFFF) < NUM_PERMUTATIONS:
+            return PERMUTATIONS[self.randrange(NUM_PERMUTATIONS)]
+        return PERMUTATIONS[product >> 32]
+
+    def randint(self, a, b):
+        # type: (int, int) -> int
+
+        return a + self.randrange(b - a + 1)
+
+    def random(self):
+        # type: () -> float
+
+        """
+        Return a float in [0, 1) with a precision of 32 bits.
+        """
+
+        try:
+            return self._next_word() * (1.0 / 4294967296.0)
+        except StopIteration:
+            return self._refill() * (1.0 / 4294967296.0)
+
+    def randrange(self, n):
+        # type: (int) -> int
+
+        """
+        Return an integer in [0, n). A word is scaled to the range by a multiplication, and the rare words which would
+        bias the result are rejected (Lemire's method).
+        """
+
+        if n <= 0:
+            raise ValueError('Empty range for randrange({})'.format(n))
+        try:
+            product = self._next_word() * n
+        except StopIteration:
+            product = self._refill() * n
+        if (product & 0xFFFFFFFF) < n:
+            if n > 4294967296:
+                return self._random.randrange(n)
+            threshold = (4294967296 - n) % n
+            while (product & 0xFFFFFFFF) < threshold:
+                try:
+                    product = self._next_word() * n
+                except StopIteration:
+                    product = self._refill() * n
+        return product >> 32
+
+    def shuffle(self, sequence):
+        # type: (MutableSequence[Any]) -> None
+
+        for i in range(len(sequence) - 1, 0, -1):
+            j = self.randrange(i + 1)
+            sequence[i], sequence[j] = sequence[j], sequence[i]
+
+    def words(self, size):
+        # type: (int) -> Any
+
+        """
+        Return a NumPy array of 'size' random 32-bit words, drawn at once from the underlying generator. This is for the
+        algorithms which make their decisions by whole arrays.
+        """
+
+        if numpy is None:
+            raise RuntimeError('NumPy is required for drawing arrays of words')
+        if self._generator is not None:
+            return self._generator.integers(0, 1 << 32, size=size, dtype=numpy.uint32)
+
+        return numpy.frombuffer(self._random.getrandbits(32 * size).to_bytes(4 * size, 'little'), dtype='<u4')
+
+    def _refill(self):
+        # type: () -> int
+
+        """
+        Draw a new block of words and return the first one.
+        """
+
+        if self._generator is not None:
+            words = self._generator.integers(0, 1 << 32, size=RandomSource.BLOCK_SIZE, dtype=numpy.uint32).tolist()
+        else:
+            block = self._random.getrandbits(32 * RandomSource.BLOCK_SIZE).to_bytes(4 * RandomSource.BLOCK_SIZE, 'little')
+            words = struct.unpack('<{}I'.format(RandomSource.BLOCK_SIZE), block)
+        self._next_word = iter(words).__next__
+        return self._next_word()
@@ -0,0 +1,340 @@
+"""
+Local maze generation service.
+
+The server accepts generation requests over a local TCP or Unix socket, runs them in a bounded pool of worker processes
+and streams the mazes back in their binary format (see :meth:`maze.Maze.export_to_bytes`). Identical seeded requests
+which are in flight at the same time are merged into one job.
+
+Protocol: the client sends one JSON object per line, either a generation request::
+
+    {"algorithm": "Frontier", "width": 100, "height": 100, "parameters": null, "seed": 42}
+
+or ``{"command": "stats"}``. The server answers each line with a JSON header line, ``{"status": "ok", "size": N}``
+followed by N bytes of payload (the maze, or the JSON statistics), or ``{"status": "error", "message": "..."}``.
+Requests of a connection are answered in order.
+
+Usage::
+
+    python service.py serve --port 8765 --workers 4
+    python service.py bench --port 8765 --requests 1000 --concurrency 32
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import random
+import time
+
+from algorithms import ALGORITHMS, generate_bytes
+
+try:
+    from typing import Any, Dict, List, Union
+except ImportError:
+    Any, Dict, List, Union = None, None, None, None
+
+
+CHUNK_SIZE = 1 << 16  # Size of the chunks of the streamed payloads.
+MAX_LINE_SIZE = 1 << 16  # Maximum size of a request line.
+
+
+class RequestError(Exception):
+    """
+    Invalid request. The message is sent back to the client.
+    """
+
+    pass
+
+
+class Server(object):
+    """
+    The generation service. At most 'max_pending' jobs are queued or running at once. Beyond that, the connections
+    wait for a slot before their next request is read, which pushes back on the clients.
+    """
+
+    def __init__(self, max_workers=None, max_pending=64, max_cells=1 << 24):
+        # type: (Union[int, None], int, int) -> None
+
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers)  # type: concurrent.futures.Executor
+        self._max_pending = max_pending  # type: int
+        self._max_cells = max_cells  # type: int
+        self._slots = None  # type: Union[asyncio.Semaphore, None]
+        self._in_flight = dict()  # type: Dict[str, asyncio.Future]
+        self._stats = {
+            'requests': 0,
+            'coalesced': 0,
+            'jobs_completed': 0,
+            'errors': 0,
+            'bytes_sent': 0,
+            'connections': 0,
+            'waiting': 0,  # Jobs waiting for a slot.
+            'running': 0,  # Jobs in the worker processes.
+        }  # type: Dict[str, int]
+
+    def close(self):
+        # type: () -> None
+
+        self._executor.shutdown()
+
+    async def generate(self, request):
+        # type: (Dict[str, Any]) -> bytes
+
+        """
+        Generate the maze of a request, merging it with an identical job in flight if there is one.
+        """
+
+        self._stats['requests'] += 1
+        arguments = Server._parse(request, self._max_cells)
+
+        # Unseeded requests must give different mazes, so they are never merged.
+        key = json.dumps(arguments, sort_keys=True) if arguments[4] is not None else None
+        if key is not None and key in self._in_flight:
+            self._stats['coalesced'] += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        job = asyncio.ensure_future(self._run_job(arguments))
+        if key is not None:
+            self._in_flight[key] = job
+            job.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        return await asyncio.shield(job)
+
+    async def handle(self, reader, writer):
+        # type: (asyncio.StreamReader, asyncio.StreamWriter) -> None
+
+        self._stats['connections'] += 1
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # The line is longer than the limit of the stream: the rest of it cannot be told from the next
+                    # requests, so the connection is closed after the error.
+                    self._stats['errors'] += 1
+                    message = 'Requests are at most {} bytes'.format(MAX_LINE_SIZE)
+                    await Server._send_header(writer, {'status': 'error', 'message': message})
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    if not isinstance(request, dict):
+                        raise RequestError('Requests are JSON objects')
+                    if request.get('command') == 'stats':
+                        payload = json.dumps(self.stats()).encode('utf-8')
+                    else:
+                        payload = await self.generate(request)
+                except (RequestError, ValueError) as error:
+                    self._stats['errors'] += 1
+                    await Server._send_header(writer, {'status': 'error', 'message': str(error)})
+                    continue
+                await Server._send_header(writer, {'status': 'ok', 'size': len(payload)})
+                for start in range(0, len(payload), CHUNK_SIZE):
+                    writer.write(payload[start:start + CHUNK_SIZE])
+                    await writer.drain()
+                self._stats['bytes_sent'] += len(payload)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._stats['connections'] -= 1
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        # type: (str, int, Union[str, None]) -> None
+
+        """
+        Serve forever on a TCP port of the given host, or on a Unix socket if a path is given.
+        """
+
+        self._slots = asyncio.Semaphore(self._max_pending)
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path, limit=MAX_LINE_SIZE)
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=MAX_LINE_SIZE)
+        async with server:
+            await server.serve_forever()
+
+    def stats(self):
+        # type: () -> Dict[str, int]
+
+        stats = dict(self._stats)
+        stats['queue_depth'] = stats['waiting'] + stats['running']
+        stats['in_flight'] = len(self._in_flight)
+        return stats
+
+    @staticmethod
+    def _parse(request, max_cells):
+        # type: (Dict[str, Any], int) -> List[Any]
+
+        algorithm = request.get('algorithm')
+        width = request.get('width')
+        height = request.get('height')
+        parameters = request.get('parameters')
+        seed = request.get('seed')
+        if algorithm not in ALGORITHMS:
+            raise RequestError('Unknown algorithm {}'.format(algorithm))
+        if not isinstance(width, int) or not isinstance(height, int) or width <= 0 or height <= 0:
+            raise RequestError('Invalid size {}x{}'.format(width, height))
+        if width * height > max_cells:
+            raise RequestError('Too many cells: {}x{} > {}'.format(width, height, max_cells))
+        if parameters is not None and not isinstance(parameters, list):
+            raise RequestError('Parameters must be a list')
+        if seed is not None and not isinstance(seed, int):
+            raise RequestError('Seeds must be integers')
+
+        return [algorithm, width, height, parameters, seed]
+
+    async def _run_job(self, arguments):
+        # type: (List[Any]) -> bytes
+
+        self._stats['waiting'] += 1
+        async with self._slots:
+            self._stats['waiting'] -= 1
+            self._stats['running'] += 1
+            try:
+                result = await asyncio.get_event_loop().run_in_executor(self._executor, generate_bytes, *arguments)
+            except Exception as error:
+                raise RequestError('Generation failed: {}'.format(error))
+            finally:
+                self._stats['running'] -= 1
+        self._stats['jobs_completed'] += 1
+
+        return result
+
+    @staticmethod
+    async def _send_header(writer, header):
+        # type: (asyncio.StreamWriter, Dict[str, Any]) -> None
+
+        writer.write(json.dumps(header).encode('utf-8') + b'\n')
+        await writer.drain()
+
+
+class Client(object):
+    """
+    Client of the service, e.g. for load testing it over the loopback. Requests are sent one at a time on a connection:
+    use several clients for concurrent requests.
+    """
+
+    def __init__(self, reader, writer):
+        # type: (asyncio.StreamReader, asyncio.StreamWriter) -> None
+
+        self._reader = reader  # type: asyncio.StreamReader
+        self._writer = writer  # type: asyncio.StreamWriter
+
+    async def close(self):
+        # type: () -> None
+
+        self._writer.close()
+        await self._writer.wait_closed()
+
+    @staticmethod
+    async def connect(host='127.0.0.1', port=8765, path=None):
+        # type: (str, int, Union[str, None]) -> Client
+
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+
+        return Client(reader, writer)
+
+    async def generate(self, algorithm, width, height, parameters=None, seed=None):
+        # type: (str, int, int, Any, Union[int, None]) -> bytes
+
+        return await self._request({'algorithm': algorithm, 'width': width, 'height': height,
+                                    'parameters': parameters, 'seed': seed})
+
+    async def stats(self):
+        # type: () -> Dict[str, int]
+
+        return json.loads((await self._request({'command': 'stats'})).decode('utf-8'))
+
+    async def _request(self, request):
+        # type: (Dict[str, Any]) -> bytes
+
+        self._writer.write(json.dumps(request).encode('utf-8') + b'\n')
+        await self._writer.drain()
+        header = json.loads((await self._reader.readline()).decode('utf-8'))
+        if header['status'] != 'ok':
+            raise RequestError(header['message'])
+
+        return await self._reader.readexactly(header['size'])
+
+
+async def load_test(num_requests, concurrency, algorithm, width, height, num_seeds, host='127.0.0.1', port=8765,
+                    path=None):
+    # type: (int, int, str, int, int, int, str, int, Union[str, None]) -> Dict[str, Any]
+
+    """
+    Send 'num_requests' requests from 'concurrency' connections, with seeds drawn at random from 'num_seeds' values so
+    that requests for the same seed are in flight together and can be merged, and return a summary.
+    """
+
+    clients = [await Client.connect(host, port, path) for _ in range(concurrency)]
+    latencies = list()  # type: List[float]
+    num_bytes = [0]
+    counter = iter(range(num_requests))
+
+    async def worker(client):
+        # type: (Client) -> None
+
+        for i in counter:
+            # Seeds taken in turn would only repeat once 'num_seeds' requests are done: draw them instead.
+            seed = random.Random(i).randrange(num_seeds)
+            start = time.perf_counter()
+            num_bytes[0] += len(await client.generate(algorithm, width, height, seed=seed))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(client) for client in clients])
+    duration = time.perf_counter() - start
+    stats = await clients[0].stats()
+    for client in clients:
+        await client.close()
+
+    latencies.sort()
+    return {
+        'requests': num_requests,
+        'duration': duration,
+        'requests_per_second': num_requests / duration,
+        'megabytes_per_second': num_bytes[0] / duration / 1e6,
+        'latency_p50': latencies[len(latencies) // 2],
+        'latency_p99': latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)],
+        'server': stats,
+    }
+
+
+def main():
+    # type: () -> None
+
+    parser = argparse.ArgumentParser(description='Local maze generation service.')
+    parser.add_argument('mode', choices=('serve', 'bench'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', metavar='PATH', help='Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, help='number of worker processes (serve)')
+    parser.add_argument('--max-pending', type=int, default=64, help='maximum number of queued or running jobs (serve)')
+    parser.add_argument('--requests', type=int, default=1000, help='number of requests (bench)')
+    parser.add_argument('--concurrency', type=int, default=16, help='number of connections (bench)')
+    parser.add_argument('--algorithm', default='RecursiveBackTracker', choices=sorted(ALGORITHMS), help='(bench)')
+    parser.add_argument('--size', default='50x50', help='WIDTHxHEIGHT (bench)')
+    parser.add_argument('--seeds', type=int, default=100, help='number of distinct seeds (bench)')
+    arguments = parser.parse_args()
+
+    if arguments.mode == 'serve':
+        server = Server(arguments.workers, arguments.max_pending)
+        try:
+            asyncio.run(server.serve(arguments.host, arguments.port, arguments.unix))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+    else:
+        width, height = (int(n) for n in arguments.size.split('x'))
+        summary = asyncio.run(load_test(arguments.requests, arguments.concurrency, arguments.algorithm, width, height,
+                                        arguments.seeds, arguments.host, arguments.port, arguments.unix))
+        print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
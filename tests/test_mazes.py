@@ -0,0 +1,180 @@
+"""
+Checks of the behavior of the algorithms and of the compositions of mazes. Run them with 'python -m pytest' or
+'python -m unittest' from the root of the repository.
+"""
+
+import hashlib
+import os
+import random
+import tempfile
+import unittest
+
+import main
+from algorithms import ALGORITHMS, Frontier, Generation, Kruskal, RecursiveBackTracker
+from maze import DOWN, RIGHT, DisjointSet, Maze
+from randomness import RandomSource
+
+try:
+    from typing import Tuple
+except ImportError:
+    Tuple = None
+
+# Seeded runs of the algorithms: (algorithm, width, height, parameters, SHA-1 prefix of the maze in its binary format).
+# The hashes pin the output for seed 5: a change of a random draw shows up here.
+SEEDED_CASES = [
+    ('BinaryTree', 23, 17, None, '0878fcabcac2a04a'),
+    ('Braid', 23, 17, None, '640d2569539fc16a'),
+    ('Frontier', 23, 17, None, '631aa1d6999be1e4'),
+    ('Frontier', 23, 17, [None, (0, 0), True], '7b5163dd2c3f2d0a'),
+    ('GrowingTree', 23, 17, [None, None, 'newest:1,random:1,oldest:1'], 'ec736291b6f10e67'),
+    ('HuntAndKill', 23, 17, None, '37b632ccb095e90b'),
+    ('Kruskal', 23, 17, None, '2850a595fda165c9'),
+    ('Labyrinth', 23, 17, None, '7fbc263521a5cc36'),
+    ('Labyrinth2', 20, 20, None, 'c8f9c0ee9cd17614'),
+    ('Lattice', 23, 17, None, '42a0e2fea17c7cd5'),
+    ('Passage', 23, 17, [None, (0, 0), (22, 16)], '7a2f12b3e9a7ac1e'),
+    ('RecursiveBackTracker', 23, 17, None, '984a65af0aab7158'),
+    ('RecursiveBackTracker2', 23, 17, None, '42a0e2fea17c7cd5'),
+    ('Room', 23, 17, None, 'c8965144912b881c'),
+    ('Sidewinder', 23, 17, None, '8d8d6f2530334bd6'),
+    ('Spiral', 23, 17, [None, [(0, 0)], True], 'a6392e92a1a16dd1'),
+]
+
+
+def count_components(maze):
+    # type: (Maze) -> Tuple[int, int]
+
+    """
+    Return the number of connected components of a maze and its number of links.
+    """
+
+    width = maze.width()
+    masks = maze.export_to_masks()
+    parents = list(range(len(masks)))
+
+    def find(index):
+        # type: (int) -> int
+
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    num_links = 0
+    num_components = len(masks)
+    for index, mask in enumerate(masks):
+        for bit, neighbor in ((4, index + 1), (8, index + width)):
+            if mask & bit:
+                num_links += 1
+                root, other = find(index), find(neighbor)
+                if root != other:
+                    parents[root] = other
+                    num_components -= 1
+
+    return num_components, num_links
+
+
+def is_perfect(maze):
+    # type: (Maze) -> bool
+
+    """
+    Return whether there is exactly one path between any two cells of a maze.
+    """
+
+    num_components, num_links = count_components(maze)
+    return num_components == 1 and num_links == maze.width() * maze.height() - 1
+
+
+def digest(maze):
+    # type: (Maze) -> str
+
+    return hashlib.sha1(maze.export_to_bytes()).hexdigest()[:16]
+
+
+class GenerationTest(unittest.TestCase):
+    def test_seeded_output(self):
+        # type: () -> None
+
+        for name, width, height, parameters, expected in SEEDED_CASES:
+            maze = ALGORITHMS[name].start(width, height, parameters, RandomSource(5)).finish()
+            self.assertEqual(digest(maze), expected, name)
+
+    def test_steps(self):
+        # type: () -> None
+
+        for name, width, height, parameters, expected in SEEDED_CASES:
+            generation = ALGORITHMS[name].start(width, height, parameters, RandomSource(5))
+            while not generation.is_done():
+                generation.step(7)
+            self.assertEqual(digest(generation.maze()), expected, name)
+
+    def test_resumes_from_checkpoints(self):
+        # type: () -> None
+
+        file_descriptor, path = tempfile.mkstemp()
+        os.close(file_descriptor)
+        try:
+            for name, width, height, parameters, expected in SEEDED_CASES:
+                generation = ALGORITHMS[name].start(width, height, parameters, RandomSource(5))
+                while not generation.is_done():
+                    generation.step(7)
+                    generation.save(path)
+                    generation = Generation.load(path)
+                self.assertEqual(digest(generation.maze()), expected, name)
+        finally:
+            os.remove(path)
+
+
+class KruskalTest(unittest.TestCase):
+    def test_rounds_open_the_links_of_sequential_kruskal(self):
+        # type: () -> None
+
+        for width, height in ((1, 1), (1, 9), (9, 1), (17, 13), (40, 30)):
+            generation = Kruskal.start(width, height, None, RandomSource(7))
+            # Draw the links, one unit of work per cell, then take them one after the other in the order of their ranks.
+            generation.step(width * height)
+            links = generation._links[generation._ranks.argsort()].tolist()
+            expected = Maze(width, height, True)
+            trees = DisjointSet(width * height)
+            for link in links:
+                cell = link >> 1
+                neighbor = cell + (width if link & 1 else 1)
+                if trees.union(cell, neighbor) >= 0:
+                    expected.set_link(cell, DOWN if link & 1 else RIGHT, True)
+            maze = generation.finish()
+            self.assertEqual(maze.export_to_bytes(), expected.export_to_bytes(), (width, height))
+            self.assertTrue(is_perfect(maze))
+
+
+class RegenerationTest(unittest.TestCase):
+    def test_regenerated_mazes_stay_perfect(self):
+        # type: () -> None
+
+        rng = random.Random(0)
+        algorithms = ['BinaryTree', 'Frontier', 'Kruskal', 'Labyrinth', 'RecursiveBackTracker', 'Sidewinder']
+        for trial in range(240):
+            algorithm = ALGORITHMS[rng.choice(algorithms)]
+            maze = (Frontier if trial % 2 else RecursiveBackTracker).run(25, 18, None, RandomSource(trial))
+            width = rng.randint(1, 25)
+            height = rng.randint(1, 18)
+            x = rng.randint(0, 25 - width)
+            y = rng.randint(0, 18 - height)
+            before = maze.export_to_masks()
+            maze.regenerate_region(x, y, width, height, algorithm, None, RandomSource(trial))
+            after = maze.export_to_masks()
+            self.assertTrue(is_perfect(maze), (algorithm, x, y, width, height))
+            for index in range(len(before)):
+                if not (x <= index % 25 < x + width and y <= index // 25 < y + height):
+                    self.assertEqual(before[index], after[index])
+
+
+class LayoutTest(unittest.TestCase):
+    def test_letters_are_perfect(self):
+        # type: () -> None
+
+        for _ in range(3):
+            self.assertTrue(is_perfect(main.letters(239, 134)))
+
+
+if __name__ == '__main__':
+    unittest.main()